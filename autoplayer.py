@@ -0,0 +1,133 @@
+# -*- coding: utf-8
+
+from __future__ import print_function
+import json
+from tetris import Tetrimino, LEFT, RIGHT, ROTATE, QUICKFALL
+
+
+#______________________________________________________________________________
+
+# Default board evaluation weights, for the number of holes, the sum of the
+# column heights, the bumpiness (sum of height differences between adjacent
+# columns) and the number of lines cleared by a placement.
+defaultweights = (-0.36, -0.51, -0.18, 0.76)
+
+
+#______________________________________________________________________________
+
+class AutoPlayer(object):
+    """A player bot that places each tetrimino where a weighted sum of features
+    of the resulting board (holes, heights, bumpiness and lines cleared) is the
+    highest. Only placements reachable by rotating first, then moving sideways
+    and then falling straight down are considered.
+    """
+
+    def __init__(self, weights=defaultweights):
+        """AutoPlayer constructor. It sets the board evaluation weights.
+        """
+        super(AutoPlayer, self).__init__()
+        self.weights = tuple(weights)
+
+
+    @staticmethod
+    def load(filename):
+        """Returns an autoplayer with the best weights saved by the tuner in
+        the given checkpoint file.
+        """
+        with open(filename) as checkpointfile:
+            return AutoPlayer(json.load(checkpointfile)['best']['weights'])
+
+
+    def evaluate(self, grid, cells, row, col):
+        """Returns the evaluation of the board resulting from attaching a
+        tetrimino's cells to the grid at the given position (and clearing any
+        completed rows). The grid is left unchanged.
+        """
+        for i, j in cells:
+            grid[row + i][col + j] = 1
+
+        rows, cols = len(grid), len(grid[0])
+        kept = [i for i in range(1, rows - 1) if 0 in grid[i]]
+        lines = rows - 2 - len(kept)
+        heights = holes = bumpiness = 0
+        previous = None
+        for j in range(1, cols - 1):
+            height = 0
+            for k, i in enumerate(kept):
+                if grid[i][j]:
+                    if not height:
+                        height = len(kept) - k
+                elif height:
+                    holes += 1
+            heights += height
+            if previous is not None:
+                bumpiness += abs(height - previous)
+            previous = height
+
+        for i, j in cells:
+            grid[row + i][col + j] = 0
+
+        w = self.weights
+        return w[0]*holes + w[1]*heights + w[2]*bumpiness + w[3]*lines
+
+
+    def best_placement(self, grid, piece, angle, row, col):
+        """Returns the best placement (rotation index, column and row) for a
+        tetrimino currently at the given rotation and position, or None if it
+        cannot be placed anywhere.
+        """
+        rotations = Tetrimino.cellmap[piece]
+
+        def collides(a, r, c):
+            for i, j in rotations[a]:
+                if grid[r + i][c + j]:
+                    return True
+            return False
+
+        best = None
+        bestvalue = None
+        for turns in range(4):
+            if turns:
+                angle = (angle + 1) % 4
+                if collides(angle, row, col):
+                    break
+            for direction in (-1, 1):
+                c = col if direction == -1 else col + 1
+                while not collides(angle, row, c):
+                    r = row
+                    while not collides(angle, r + 1, c):
+                        r += 1
+                    value = self.evaluate(grid, rotations[angle], r, c)
+                    if bestvalue is None or value > bestvalue:
+                        best, bestvalue = (angle, c, r), value
+                    c += direction
+        return best
+
+
+    def plan(self, grid, piece, angle, row, col):
+        """Returns the list of actions that takes a tetrimino from its current
+        rotation and position to its best placement.
+        """
+        placement = self.best_placement(grid, piece, angle, row, col)
+        if placement is None:
+            return []
+        targetangle, targetcol, targetrow = placement
+        actions  = [ROTATE] * ((targetangle - angle) % 4)
+        actions += [LEFT] * (col - targetcol) + [RIGHT] * (targetcol - col)
+        actions += [QUICKFALL] * (targetrow - row)
+        return actions
+
+
+    def place(self, engine):
+        """Places the current tetrimino of a tetrisenv.TetrisEngine at its best
+        placement and locks it there right away (without the player actions
+        and timed updates it would take in a real gameplay). Returns False if
+        it could not be placed.
+        """
+        placement = self.best_placement(engine.grid, engine.piece,
+                                        engine.angle, engine.row, engine.col)
+        if placement is None:
+            return False
+        engine.angle, engine.col, engine.row = placement
+        engine.tick()
+        return True
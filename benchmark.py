@@ -0,0 +1,158 @@
+# -*- coding: utf-8
+
+from __future__ import print_function
+import json, os, platform, random, subprocess, sys, time
+import gamebasics
+from tetris import TetrisScene, TetrisGame, \
+    NOOP, LEFT, RIGHT, ROTATE, QUICKFALL, TICK
+from tetrisenv import TetrisEngine
+
+
+#______________________________________________________________________________
+
+# Actions of the simulated players, drawn at random (timed updates included).
+actions = (NOOP, LEFT, RIGHT, ROTATE, QUICKFALL, TICK)
+
+
+def measure(step, seconds):
+    """Calls step (which returns the number of steps it took) repeatedly for
+    about the given number of seconds. Returns the steps per second.
+    """
+    steps = 0
+    begin = time.time()
+    elapsed = 0.0
+    while elapsed < seconds:
+        steps += step()
+        elapsed = time.time() - begin
+    return steps / elapsed
+
+
+def engine_steps(seconds, gridsize, batch=1000):
+    """Returns the throughput of tetrisenv.TetrisEngine, in actions per second.
+    """
+    rng = random.Random(0)
+    engine = TetrisEngine(gridsize, seed=0)
+
+    def step():
+        for _ in range(batch):
+            action = rng.choice(actions)
+            engine.tick() if action == TICK else engine.perform(action)
+            engine.lost and engine.reset()
+        return batch
+    return measure(step, seconds)
+
+
+def scene_steps(seconds, gridsize, batch=1000):
+    """Returns the throughput of the rules of TetrisScene (in a headless game,
+    with no drawing), in actions per second.
+    """
+    rng = random.Random(0)
+    game = gamebasics.Game(headless=True, fixedstep=True)
+    scene = TetrisScene(game, gridsize)
+    scene.newgame(seed=0)
+
+    def step():
+        for _ in range(batch):
+            action = rng.choice(actions)
+            action == NOOP or scene.perform(action)
+            scene.running or scene.newgame()
+        return batch
+    return measure(step, seconds)
+
+
+def frames(seconds, gridsize, batch=100):
+    """Returns the throughput of whole frames (events, timers, update and
+    drawing) of a headless TetrisGame played at random, in frames per second.
+    """
+    rng = random.Random(0)
+    game = TetrisGame(gridsize, headless=True)
+    game.running = True
+    scene = game.currscene
+
+    def step():
+        for _ in range(batch):
+            action = rng.choice(actions[:-1])
+            action == NOOP or scene.perform(action)
+            game.handle_user_events()
+            game.handle_timer_events()
+            game.update()
+            game.draw()
+            game.delay()
+            if not scene.running:
+                game.running = True
+                scene.newgame()
+        return batch
+    return measure(step, seconds)
+
+
+def run(seconds, gridsize):
+    """Runs the benchmarks on the current interpreter. Returns a dict with
+    the interpreter and the throughput of each benchmark.
+    """
+    result = {
+        'interpreter': '{} {}'.format(platform.python_implementation(),
+                                      platform.python_version()),
+        'executable' : sys.executable
+    }
+    # TetrisScene prints at game over.
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        for name, benchmark in (('engine', engine_steps),
+                                ('scene', scene_steps), ('frames', frames)):
+            result[name] = benchmark(seconds, gridsize)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return result
+
+
+def report(results):
+    """Formats the results of several interpreters as a table.
+    """
+    lines = ['{:<24} {:>14} {:>14} {:>12}'.format(
+        'Interpreter', 'Engine (op/s)', 'Scene (op/s)', 'Frames (/s)')]
+    for result in results:
+        lines.append('{:<24} {:>14} {:>14} {:>12}'.format(
+            result['interpreter'],
+            *('{:.0f}'.format(result[name])
+              for name in ('engine', 'scene', 'frames'))))
+    return '\n'.join(lines)
+
+
+
+#______________________________________________________________________________
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Measure the simulation and frame throughput of the game '
+                    'on one or more Python interpreters')
+    parser.add_argument('interpreters', nargs='*', metavar='INTERPRETER',
+                        help='interpreters to compare (e.g. python2 python3 '
+                             'pypy3), the current one if none is given')
+    parser.add_argument('--seconds', type=float, default=3.0,
+                        help='duration of each benchmark')
+    parser.add_argument('--gridsize', default=(20, 10),
+                        type=lambda size: tuple(map(int, size.split('x'))),
+                        help='rows x cols of the grid (without the border)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    if not args.interpreters:
+        results = [run(args.seconds, args.gridsize)]
+    else:
+        # Every interpreter runs this same script, reporting back in JSON
+        # (with no pygame banner before it).
+        env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+        results = []
+        for interpreter in args.interpreters:
+            output = subprocess.check_output(
+                [interpreter, os.path.abspath(__file__), '--json',
+                 '--seconds', str(args.seconds),
+                 '--gridsize', '{}x{}'.format(*args.gridsize)],
+                cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+            results.extend(json.loads(output.decode('utf-8')))
+    print(json.dumps(results) if args.json else report(results))
@@ -0,0 +1,600 @@
+# -*- coding: utf-8
+
+from __future__ import print_function
+import json, multiprocessing, os, random, sys, time
+import gamebasics
+from tetris import TetrisScene, speedintervals, \
+    NOOP, LEFT, RIGHT, ROTATE, QUICKFALL
+from autoplayer import AutoPlayer
+from tetrisenv import TetrisEngine, VectorTetrisEnv, tickframes, nactions
+
+try:
+    import numpy
+except ImportError: # Only the vector environment needs NumPy.
+    numpy = None
+
+
+#______________________________________________________________________________
+
+# Fields of the gameplay state compared after every step, in this order, once
+# it is checked that the timed update happened in the same steps ('tick'). The
+# grid (with the obstacle border) is only compared after timed updates, which
+# are the only steps that can change it.
+fields = ('piece', 'next', 'angle', 'row', 'col', 'score', 'lines',
+          'speedlevel', 'lost')
+
+# Relative frequencies of NOOP, LEFT, RIGHT, ROTATE and QUICKFALL in the
+# random action sequences.
+actionweights = (4, 3, 3, 3, 2)
+
+
+def make_case(seed, gridsize=(20, 10), steps=2000):
+    """Returns a random test case drawn from the given seed: the seed of the
+    tetrimino sequence, the speed level and lines to start with (close to the
+    next level up), rows of garbage (rows at the bottom missing a block, mostly
+    in the same column, so lines are often cleared, several at once) and the
+    sequence of actions, one per 30 fps frame. Actions are either uniformly
+    random, guided by the autoplayer or runs of rotations, moves and quick
+    falls, like placements.
+    Games start below the last speed level, since TetrisScene.set_speedlevel
+    cannot create its timer there.
+    """
+    rng = random.Random(seed)
+    rows, cols = gridsize
+    speedlevel = rng.randint(1, len(speedintervals) - 1)
+    well = rng.randrange(cols)
+    garbage = []
+    for _ in range(rng.randint(0, rows // 2)):
+        row = [rng.randint(1, 7) for _ in range(cols)]
+        row[well if rng.random() < 0.7 else rng.randrange(cols)] = 0
+        garbage.append(row)
+    population = [a for a, w in zip((NOOP, LEFT, RIGHT, ROTATE, QUICKFALL),
+                                    actionweights) for _ in range(w)]
+    case = {
+        'gridsize'  : list(gridsize),
+        'seed'      : rng.randrange(2**32),
+        'speedlevel': speedlevel,
+        'lines'     : rng.randint(max(12*speedlevel - 6, 0),
+                                  12*speedlevel - 3),
+        'garbage'   : garbage,
+        'actions'   : []
+    }
+    mode = rng.randrange(3)
+    if mode == 0:
+        case['actions'] = [rng.choice(population) for _ in range(steps)]
+    elif mode == 1:
+        case['actions'] = guided_actions(case, rng, steps)
+    actions = case['actions']
+    while len(actions) < steps:
+        # Placement-like runs of actions spread the tetriminos over the grid.
+        run  = [ROTATE] * rng.randint(0, 3)
+        run += [rng.choice((LEFT, RIGHT))] * rng.randint(0, cols // 2)
+        run += [QUICKFALL] * rng.randint(0, rows)
+        for action in run:
+            while rng.random() < 0.2:
+                actions.append(NOOP)
+            actions.append(action)
+    del actions[steps:]
+    return case
+
+
+def guided_actions(case, rng, steps):
+    """Returns the actions of the autoplayer playing a test case in a
+    tetrisenv.TetrisEngine (with some random actions mixed in), which keep the
+    game going and clear many lines.
+    """
+    engine = TetrisEngine(case['gridsize'], case['seed'])
+    engine.reset(case['seed'], case['speedlevel'])
+    engine.lines = case['lines']
+    apply_garbage(engine.grid, case['garbage'])
+    player = AutoPlayer()
+    actions = []
+    plan = None
+    frame = 0
+    while len(actions) < steps and not engine.lost:
+        if plan is None:
+            plan = player.plan(engine.grid, engine.piece, engine.angle,
+                               engine.row, engine.col)
+        action = plan.pop(0) if plan else NOOP
+        if rng.random() < 0.05:
+            action = rng.randrange(nactions)
+        actions.append(action)
+        engine.perform(action)
+        if frame >= tickframes[engine.ticklevel - 1]:
+            frame = 0
+            row = engine.row
+            engine.tick()
+            if engine.row != row + 1:
+                plan = None # Locked, so the next tetrimino is planned.
+        frame += 1
+    return actions
+
+
+def apply_garbage(grid, garbage):
+    """Fills the bottom rows of a grid (a list of lists or an array, with the
+    obstacle border) with the given garbage rows.
+    """
+    rows = len(grid)
+    for k, row in enumerate(garbage):
+        grid[rows - 1 - len(garbage) + k][1:-1] = row
+
+
+
+#______________________________________________________________________________
+
+class ReferenceRunner(object):
+    """Runs test cases through TetrisScene, the reference implementation of the
+    rules, in a headless game. Timed updates are made by the scenes' own
+    timers, on the fixed-step clock of the game, just like in a replay or an
+    autoplayed game. Scenes are kept between batches.
+    """
+
+    def __init__(self, gridsize):
+        """ReferenceRunner constructor. It creates the headless game.
+        """
+        super(ReferenceRunner, self).__init__()
+        self.gridsize = tuple(gridsize)
+        self.game     = gamebasics.Game(headless=True, fixedstep=True)
+        self.scenes   = []
+
+
+    def start(self, cases):
+        """Begins the games of a batch of test cases.
+        """
+        while len(self.scenes) < len(cases):
+            self.scenes.append(TetrisScene(self.game, self.gridsize))
+        for scene, case in zip(self.scenes, cases):
+            # A game still running from the last batch keeps its timer, which
+            # a new game of the actual program never has.
+            scene.get_timer('TimedUpdate') and scene.del_timer('TimedUpdate')
+            scene.newgame(case['speedlevel'], case['seed'])
+            scene.lines = case['lines']
+            apply_garbage(scene.grid, case['garbage'])
+
+
+    def perform(self, k, action):
+        """Performs the action of a frame in the game of a case and then runs
+        its timers, like the game's main loop. Returns whether the timed update
+        happened.
+        """
+        scene = self.scenes[k]
+        action == NOOP or scene.perform(action)
+        timer = scene.get_timer('TimedUpdate')
+        if timer is None:
+            return False
+        lastcall = timer.lastcall
+        scene.handle_timer_events()
+        # The timer is deleted at game over, instead of being restarted.
+        return timer.lastcall != lastcall or \
+            scene.get_timer('TimedUpdate') is not timer
+
+
+    def advance(self):
+        """Advances the fixed-step clock by one frame.
+        """
+        self.game.delay()
+
+
+    def state(self, k):
+        """Returns the state of the game of a case, as a tuple of fields.
+        """
+        scene = self.scenes[k]
+        t = scene.currtetri
+        return (t.id, scene.nexttetri.id, t.angle // 90, t.row, t.col,
+                scene.score, scene.lines, scene.speedlevel, not scene.running)
+
+
+    def grid(self, k):
+        """Returns the grid of the game of a case, as a list of lists.
+        """
+        return self.scenes[k].grid
+
+
+
+#______________________________________________________________________________
+
+class EngineRunner(object):
+    """Runs test cases through tetrisenv.TetrisEngine, one engine per case,
+    timing the updates with tetrisenv.tickframes, like TetrisEnv.
+    """
+
+    def __init__(self, gridsize):
+        """EngineRunner constructor.
+        """
+        super(EngineRunner, self).__init__()
+        self.gridsize = tuple(gridsize)
+        self.engines  = []
+        self.frames   = []
+        self.ticked   = []
+
+
+    def start(self, cases, reference):
+        """Begins the games of a batch of test cases.
+        """
+        while len(self.engines) < len(cases):
+            self.engines.append(TetrisEngine(self.gridsize, 0))
+        self.frames = [0] * len(cases)
+        self.ticked = [False] * len(cases)
+        for engine, case in zip(self.engines, cases):
+            engine.reset(case['seed'], case['speedlevel'])
+            engine.lines = case['lines']
+            apply_garbage(engine.grid, case['garbage'])
+
+
+    def step(self, actions, reference):
+        """Performs one action in each game (but those whose case is over) and
+        advances one frame, with the timed update when it is due.
+        """
+        for k, action in enumerate(actions):
+            if action is None:
+                continue
+            engine = self.engines[k]
+            engine.perform(action)
+            self.ticked[k] = \
+                self.frames[k] >= tickframes[engine.ticklevel - 1]
+            if self.ticked[k]:
+                self.frames[k] = 0
+                engine.tick()
+            self.frames[k] += 1
+
+
+    def state(self, k):
+        """See the docs for ReferenceRunner.state.
+        """
+        e = self.engines[k]
+        return (e.piece, e.nextpiece, e.angle, e.row, e.col, e.score, e.lines,
+                e.speedlevel, e.lost)
+
+
+    def grid(self, k):
+        """See the docs for ReferenceRunner.grid.
+        """
+        return self.engines[k].grid
+
+
+    def ticks(self, k):
+        """Returns whether the timed update happened in the last step of the
+        game of a case.
+        """
+        return self.ticked[k]
+
+
+
+#______________________________________________________________________________
+
+class VectorRunner(object):
+    """Runs a batch of test cases through a single tetrisenv.VectorTetrisEnv,
+    one environment per case, which times its own updates. Since it draws
+    tetriminos from another random generator, the next tetrimino of each
+    environment is copied from the reference after every step (so the current
+    one, and so the spawns, are still checked).
+    """
+
+    def __init__(self, gridsize):
+        """VectorRunner constructor.
+        """
+        super(VectorRunner, self).__init__()
+        self.gridsize = tuple(gridsize)
+        self.env      = None
+
+
+    def start(self, cases, reference):
+        """See the docs for EngineRunner.start.
+        """
+        if self.env is None or self.env.count != len(cases):
+            self.env = VectorTetrisEnv(len(cases), self.gridsize)
+        env = self.env
+        env.reset()
+        for k, case in enumerate(cases):
+            env.speedlevel[k] = case['speedlevel']
+            env.ticklevel[k] = min(case['speedlevel'] + 1, len(speedintervals))
+            env.lines[k] = case['lines']
+            apply_garbage(env.grid[k], case['garbage'])
+            self.sync(k, reference)
+
+
+    def sync(self, k, reference):
+        """Copies the current and next tetriminos of a case from the reference.
+        """
+        scene = reference.scenes[k]
+        self.env.piece[k] = scene.currtetri.id
+        self.env.nextpiece[k] = scene.nexttetri.id
+
+
+    def step(self, actions, reference):
+        """Performs one action in each environment (NOOP in those whose case
+        is over) and advances one frame.
+        """
+        self.env.step([NOOP if action is None else action
+                       for action in actions])
+        for k, action in enumerate(actions):
+            if action is not None and not self.env.dones[k]:
+                self.env.nextpiece[k] = reference.scenes[k].nexttetri.id
+
+
+    def state(self, k):
+        """See the docs for ReferenceRunner.state. Lost games were already
+        reset, so only the done flag is meaningful for them.
+        """
+        env = self.env
+        if env.dones[k]:
+            return None
+        return (int(env.piece[k]), int(env.nextpiece[k]), int(env.angle[k]),
+                int(env.row[k]), int(env.col[k]), int(env.score[k]),
+                int(env.lines[k]), int(env.speedlevel[k]), False)
+
+
+    def grid(self, k):
+        """See the docs for ReferenceRunner.grid.
+        """
+        return self.env.grid[k].tolist()
+
+
+    def ticks(self, k):
+        """See the docs for EngineRunner.ticks.
+        """
+        return bool(self.env.ticked[k])
+
+
+runners = {'engine': EngineRunner}
+if numpy is not None:
+    runners['vector'] = VectorRunner
+
+
+
+#______________________________________________________________________________
+
+def compare(reference, runner, k, step, tick=None):
+    """Compares the state of a case in the reference and in an alternative
+    runner, and whether the timed update happened in both (tick is whether it
+    happened in the reference, or None before the first step). Returns None if
+    they match, or a description of the divergence.
+    """
+    if tick is not None and runner.ticks(k) != tick:
+        return {'step': step, 'field': 'tick', 'expected': tick,
+                'actual': runner.ticks(k)}
+    expected = reference.state(k)
+    actual = runner.state(k)
+    if actual is None:
+        # Only the vector runner hides the state of lost games.
+        actual = expected[:-1] + (True,)
+        if expected[-1]:
+            return None
+    for name, e, a in zip(fields, expected, actual):
+        if e != a:
+            return {'step': step, 'field': name, 'expected': e, 'actual': a}
+    if tick is not False and not expected[-1]:
+        e, a = reference.grid(k), runner.grid(k)
+        if e != a:
+            return {'step': step, 'field': 'grid', 'expected': e, 'actual': a}
+    return None
+
+
+def run_cases(reference, runner, cases):
+    """Runs a batch of test cases through the reference and an alternative
+    runner in lockstep, comparing their states after every step. Returns the
+    number of steps run and a list of (case index, divergence) pairs.
+    """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w') # TetrisScene prints at game over.
+    try:
+        reference.start(cases)
+        runner.start(cases, reference)
+        count = len(cases)
+        active = [True] * count
+        divergences = []
+        for k in range(count):
+            divergence = compare(reference, runner, k, -1)
+            if divergence:
+                divergences.append((k, divergence))
+                active[k] = False
+
+        steps = 0
+        length = max(len(case['actions']) for case in cases)
+        for step in range(length):
+            actions = [None] * count
+            ticks = [False] * count
+            for k, case in enumerate(cases):
+                if not active[k] or step >= len(case['actions']):
+                    active[k] = False
+                    continue
+                actions[k] = case['actions'][step]
+                ticks[k] = reference.perform(k, actions[k])
+            reference.advance()
+            if not any(active):
+                break
+
+            runner.step(actions, reference)
+            for k in range(count):
+                if actions[k] is None:
+                    continue
+                steps += 1
+                divergence = compare(reference, runner, k, step, ticks[k])
+                if divergence:
+                    divergences.append((k, divergence))
+                    active[k] = False
+                elif not reference.scenes[k].running:
+                    active[k] = False
+        return steps, divergences
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def minimize(case, enginename, reference=None, runner=None):
+    """Shrinks a diverging test case to a (locally) minimal one: it drops the
+    actions after the divergence, then removes ever smaller chunks of actions
+    and garbage rows while the case still diverges. Returns the minimized case
+    with its divergence.
+    """
+    gridsize = case['gridsize']
+    reference = reference or ReferenceRunner(gridsize)
+    runner = runner or runners[enginename](gridsize)
+
+    def diverges(candidate):
+        divergences = run_cases(reference, runner, [candidate])[1]
+        return divergences[0][1] if divergences else None
+
+    case = dict(case)
+    divergence = diverges(case)
+    if divergence is None:
+        return case, None
+    case['actions'] = case['actions'][:divergence['step'] + 1]
+
+    for key in ('garbage', 'actions'):
+        chunk = len(case[key]) // 2
+        while chunk >= 1:
+            start = 0
+            while start < len(case[key]):
+                candidate = dict(case)
+                candidate[key] = case[key][:start] + case[key][start + chunk:]
+                found = diverges(candidate)
+                if found:
+                    case, divergence = candidate, found
+                    case['actions'] = case['actions'][:found['step'] + 1]
+                else:
+                    start += chunk
+            chunk //= 2
+    return case, divergence
+
+
+
+#______________________________________________________________________________
+
+# Per-process state of the pool workers: the reference and the alternative
+# runners reused by all the batches a worker runs.
+workerrunners = {}
+
+
+def fuzz_batch(task):
+    """Runs a batch of seeded test cases and returns the engine name, the
+    number of steps run and the first divergence found (with its case), if
+    any. It runs on the pool workers, which keep their runners between tasks.
+    """
+    enginename, gridsize, seeds, steps = task
+    key = tuple(gridsize)
+    if key not in workerrunners:
+        workerrunners[key] = (ReferenceRunner(gridsize), {})
+    reference, alternatives = workerrunners[key]
+    if enginename not in alternatives:
+        alternatives[enginename] = runners[enginename](gridsize)
+
+    cases = [make_case(seed, gridsize, steps) for seed in seeds]
+    count, divergences = run_cases(reference, alternatives[enginename], cases)
+    if not divergences:
+        return enginename, count, None
+    k, divergence = min(divergences, key=lambda d: d[1]['step'])
+    return enginename, count, (seeds[k], cases[k], divergence)
+
+
+def fuzz(enginenames=tuple(sorted(runners)), gridsize=(20, 10), cases=1000,
+         steps=2000, batchsize=64, processes=None, seed=0):
+    """Fuzzes the given alternative engines against the reference on a pool of
+    worker processes. Returns a list of (engine name, case seed, minimized
+    case, divergence) tuples, one per engine that diverged, and prints the
+    throughput.
+    """
+    rng = random.Random(seed)
+    seeds = [rng.randrange(2**32) for _ in range(cases)]
+    tasks = [(name, list(gridsize), seeds[start:start + batchsize], steps)
+             for name in enginenames
+             for start in range(0, cases, batchsize)]
+
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    found = {}
+    total = 0
+    begin = time.time()
+    try:
+        for name, count, failure in pool.imap_unordered(fuzz_batch, tasks):
+            total += count
+            if failure and (name not in found or
+                            failure[2]['step'] < found[name][2]['step']):
+                found[name] = failure
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - begin
+    print('{} steps in {:.1f} s ({:.0f} steps/s on {} processes)'.format(
+        total, elapsed, total / max(elapsed, 1e-9), processes))
+
+    failures = []
+    for name in enginenames:
+        if name in found:
+            caseseed, case, divergence = found[name]
+            case, divergence = minimize(case, name)
+            failures.append((name, caseseed, case, divergence))
+    return failures
+
+
+def describe(name, divergence):
+    """Returns a text description of a divergence.
+    """
+    where = 'at step {}'.format(divergence['step']) \
+        if divergence['step'] >= 0 else 'at the start'
+    if divergence['field'] == 'grid':
+        expected = '\n'.join(''.join(str(c) for c in row)
+                             for row in divergence['expected'])
+        actual = '\n'.join(''.join(str(c) for c in row)
+                           for row in divergence['actual'])
+        return '{} diverges {} in the grid:\nexpected\n{}\nactual\n{}'.format(
+            name, where, expected, actual)
+    return '{} diverges {} in {}: expected {}, actual {}'.format(
+        name, where, divergence['field'], divergence['expected'],
+        divergence['actual'])
+
+
+
+#______________________________________________________________________________
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Fuzz the alternative Tetris engines against the rules of '
+                    'TetrisScene')
+    parser.add_argument('--engine', choices=sorted(runners), action='append',
+                        help='engine to fuzz (all of them, by default)')
+    parser.add_argument('--cases', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=2000,
+                        help='maximum steps (frames) per case')
+    parser.add_argument('--batch', type=int, default=64,
+                        help='cases run together by each task')
+    parser.add_argument('--gridsize', metavar='ROWSxCOLS', default='20x10',
+                        type=lambda size: tuple(map(int, size.split('x'))))
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', metavar='FILE', default='divergence.json',
+                        help='save the minimized reproducers to FILE')
+    parser.add_argument('--reproduce', metavar='FILE',
+                        help='run the reproducers saved in FILE instead')
+    args = parser.parse_args()
+
+    if args.reproduce:
+        with open(args.reproduce) as reprofile:
+            reproducers = json.load(reprofile)
+        for reproducer in reproducers:
+            name, case = reproducer['engine'], reproducer['case']
+            reference = ReferenceRunner(case['gridsize'])
+            runner = runners[name](case['gridsize'])
+            divergences = run_cases(reference, runner, [case])[1]
+            print(describe(name, divergences[0][1]) if divergences else
+                  '{} no longer diverges'.format(name))
+        sys.exit()
+
+    failures = fuzz(args.engine or sorted(runners), args.gridsize, args.cases,
+                    args.steps, args.batch, args.processes, args.seed)
+    for name, caseseed, case, divergence in failures:
+        print(describe(name, divergence))
+        print('  (case seed {}, minimized to {} actions and {} garbage rows)'
+              .format(caseseed, len(case['actions']), len(case['garbage'])))
+    if failures:
+        with open(args.output, 'w') as reprofile:
+            json.dump([{'engine': name, 'caseseed': caseseed, 'case': case,
+                        'divergence': divergence}
+                       for name, caseseed, case, divergence in failures],
+                      reprofile)
+        print('Reproducers saved to', args.output)
+        sys.exit(1)
+    print('No divergences found')
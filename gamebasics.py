@@ -1,6 +1,30 @@
 # -*- coding: utf-8
 
-import pygame
+import array, gc, inspect, io, json, mmap, os, struct, sys, threading, \
+    pygame
+
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+try:
+    import tracemalloc
+except ImportError: # Python 2 (memory profiling is not available)
+    tracemalloc = None
+
+
+# Current time (in milliseconds) of the clock of a fixed-step game, or None if
+# the game clock follows pygame's real time clock. See Game.__init__.
+fixedticks = None
+
+
+def get_ticks():
+    """Returns the number of milliseconds of the game clock. Timers, scenes
+    and sounds must use this function instead of pygame.time.get_ticks.
+    """
+    return pygame.time.get_ticks() if fixedticks is None else fixedticks
+
 
 
 #______________________________________________________________________________
@@ -12,23 +36,126 @@ class Game:
     to the current scene in execution.
     """
 
-    def __init__(self, title='', screensize=(640,480), framerate=30):
-        """Game constructor. It initializes pygame as well as some basic state
-        variables and collections.
+    def __init__(self, title='', screensize=(640,480), framerate=30,
+                 mixerconfig=None, headless=False, assetbundle=None,
+                 fixedstep=False, windowsize=None, fullscreen=False,
+                 integerscale=False, inputpoll=2, memprofile=0):
+        """Game constructor. It initializes the pygame subsystems the game
+        uses as well as some basic state variables and collections.
+        If given, mixerconfig is a dict of keyword arguments for
+        pygame.mixer.pre_init (frequency, size, channels, buffer) applied
+        before the mixer is initialized. Smaller buffers mean lower latency
+        between playing a sound and hearing it.
+        A headless game neither opens a window nor initializes the audio: it
+        draws on an off-screen surface and plays no sounds at all.
+        If assetbundle names an existing file packed by AssetBundle.pack, the
+        scenes load their resources from it instead of the separate files.
+        A fixed-step game does not wait between frames: its clock advances
+        exactly one frame time per frame, so it runs as fast as possible while
+        behaving as if it ran at the chosen frame rate.
+        Scenes always draw on a screen of screensize pixels, which is presented
+        scaled (keeping its aspect ratio) if the window has another size: the
+        given windowsize (the window is then resizable) or the whole display,
+        in fullscreen. With integerscale, the screen is only scaled by whole
+        factors (keeping pixels sharp) when the window is large enough.
+        While waiting between frames, the event queue is polled every inputpoll
+        milliseconds, so key events are timestamped (and fed to the key
+        repeater) with that accuracy instead of once per frame.
+        If memprofile is not 0, the memory allocated by the frame loop is
+        profiled and reported every memprofile frames (see MemoryProfiler).
         """
+        global fixedticks
         self.title        = title
         self.screensize   = screensize
         self.framerate    = framerate
-        self.frametime    = 1000 / framerate
+        self.frametime    = 1000 // framerate
         self.lastticks    = 0
         self.currscene    = None
         self.running      = False
         self.scenes       = {}
         self.globaltimers = {}
-
-        pygame.init()
-        self.screen = pygame.display.set_mode(self.screensize)
-        pygame.display.set_caption(self.title)
+        self.channels     = {}
+        self.headless     = headless
+        self.assetbundle  = None
+        self.fixedstep    = fixedstep
+        self.capture      = None
+        self.integerscale = integerscale
+        self.window       = None
+        self.viewport     = None
+        self.windowflags  = 0
+        self.inputpoll    = inputpoll
+        self.events       = []
+        self.handled      = []
+        self.keys         = KeyRepeater()
+        self.latency      = LatencyHistogram()
+        self.profiler     = MemoryProfiler(memprofile) if memprofile else None
+
+        # A real-time game after a fixed-step one goes back to pygame's clock.
+        fixedticks = 0 if self.fixedstep else None
+
+        # Only the subsystems actually used are brought up, instead of calling
+        # pygame.init(). Creating a clock starts the SDL timer that
+        # pygame.time.get_ticks relies on.
+        self.clock = pygame.time.Clock()
+        pygame.font.init()
+        if self.headless:
+            self.screen = pygame.Surface(self.screensize, 0, 32)
+        else:
+            if mixerconfig:
+                pygame.mixer.pre_init(**mixerconfig)
+            pygame.mixer.init()
+            pygame.display.init()
+            if fullscreen:
+                self.windowflags = pygame.FULLSCREEN
+                windowsize = windowsize or (0, 0) # the display resolution
+            elif windowsize:
+                self.windowflags = pygame.RESIZABLE
+            pygame.display.set_mode(windowsize or self.screensize,
+                                    self.windowflags)
+            pygame.display.set_caption(self.title)
+            self.setup_viewport()
+
+        if assetbundle and os.path.exists(assetbundle):
+            self.assetbundle = AssetBundle(assetbundle)
+
+
+    def setup_viewport(self):
+        """Sets up the area of the window (the viewport) where the screen is
+        presented, centered and as large as possible. If the window has the
+        same size as the screen, scenes draw on the window directly.
+        """
+        self.window = pygame.display.get_surface()
+        winwidth, winheight = self.window.get_size()
+        width, height = self.screensize
+        if (winwidth, winheight) == (width, height):
+            self.screen   = self.window
+            self.viewport = None
+            return
+
+        # Whole factors only need pixels to be repeated (a much faster scaling
+        # and sharp results), but other factors need smooth scaling.
+        factor = min(winwidth // width, winheight // height)
+        if factor >= 1 and self.integerscale:
+            size = width * factor, height * factor
+            self.scale = pygame.transform.scale
+        else:
+            ratio = min(winwidth / float(width), winheight / float(height))
+            size = int(width * ratio), int(height * ratio)
+            self.scale = pygame.transform.smoothscale
+        rect = pygame.Rect((0, 0), size)
+        rect.center = winwidth // 2, winheight // 2
+
+        self.window.fill((0, 0, 0))
+        self.viewport = self.window.subsurface(rect)
+        self.screen   = pygame.Surface(self.screensize).convert(self.window)
+
+
+    def present(self):
+        """Presents the screen on the window, scaling it straight into the
+        viewport (nothing to be done if the scenes drew on the window).
+        """
+        if self.viewport:
+            self.scale(self.screen, self.viewport.get_size(), self.viewport)
 
 
     def add_scene(self, scenename, scene):
@@ -75,6 +202,43 @@ class Game:
         return self.globaltimers.get(timername)
 
 
+    def add_channel(self, channelname, mininterval=0):
+        """Reserves a dedicated mixer channel for a named category of sounds.
+        Reserved channels are never picked by Sound.play(), so sounds played on
+        them need no search for a free channel. See SoundChannel for the
+        meaning of mininterval.
+        """
+        if self.headless:
+            return
+        index = len(self.channels)
+        if pygame.mixer.get_num_channels() <= index:
+            pygame.mixer.set_num_channels(index + 1)
+        pygame.mixer.set_reserved(index + 1)
+        channel = SoundChannel(pygame.mixer.Channel(index), mininterval)
+        self.channels.update({channelname: channel})
+
+
+    def get_channel(self, channelname):
+        """Gets a named sound channel of the game.
+        """
+        return self.channels.get(channelname)
+
+
+    def start_capture(self, filename, queuesize=8):
+        """Starts capturing every frame drawn on the screen. See FrameCapture
+        for the meaning of the arguments.
+        """
+        self.stop_capture()
+        self.capture = FrameCapture(self.screen, filename, queuesize)
+
+
+    def stop_capture(self):
+        """Stops capturing frames, waiting until all of them are written.
+        """
+        capture, self.capture = self.capture, None
+        capture and capture.close()
+
+
     def start(self):
         """Starts the main loop of the game.
         """
@@ -88,13 +252,35 @@ class Game:
         self.running = False
 
 
+    def poll_events(self):
+        """Takes the events waiting in pygame's queue, timestamping key presses
+        and releases in the key repeater, and keeps them to be handled.
+        """
+        if self.headless:
+            return
+        ticks = get_ticks()
+        for event in pygame.event.get():
+            if event.type == pygame.KEYDOWN:
+                self.keys.press(event.key, ticks)
+            elif event.type == pygame.KEYUP:
+                self.keys.release(event.key, ticks)
+            self.events.append(event)
+
+
     def handle_user_events(self):
         """Handles global user events that can happen at any scene.
         """
-        events = pygame.event.get()
+        # The two event lists are swapped every frame instead of reallocated.
+        self.poll_events()
+        events = self.events
+        self.events, self.handled = self.handled, events
+        del self.events[:]
         for event in events:
             if event.type == pygame.QUIT:
                 self.quit()
+            elif event.type == pygame.VIDEORESIZE:
+                pygame.display.set_mode(event.size, self.windowflags)
+                self.setup_viewport()
 
         self.currscene and self.currscene.handle_user_events(events)
 
@@ -102,15 +288,15 @@ class Game:
     def handle_timer_events(self):
         """Handles gobal timer events that can happen at any scene.
         """
-        for timername, timer in self.globaltimers.items():
+        for timername, timer in list(self.globaltimers.items()):
             if timer.paused:
                 continue
-            elapsedtime = pygame.time.get_ticks() - timer.lastcall
+            elapsedtime = get_ticks() - timer.lastcall
             if elapsedtime >= timer.interval:
                 timer.callback(timer.arguments) if timer.arguments else \
                     timer.callback()
                 if timername in self.globaltimers:
-                    self.globaltimers[timername].lastcall = pygame.time.get_ticks()
+                    self.globaltimers[timername].lastcall = get_ticks()
 
         self.currscene and self.currscene.handle_timer_events()
 
@@ -125,27 +311,45 @@ class Game:
         """Draws all graphical elements (sprites, BGs, texts, etc) on the screen.
         """
         self.currscene and self.currscene.draw()
-        pygame.display.update()
+        self.capture and self.capture.capture(self.screen)
+        if not self.headless:
+            self.present()
+            pygame.display.update()
+            self.latency.pending and self.latency.present(get_ticks())
 
 
     def delay(self):
         """Delays the main loop so that the game runs at the chosen frame rate.
+        A fixed-step game just advances its clock instead.
         """
+        global fixedticks
+        if self.fixedstep:
+            fixedticks += self.frametime
+            return
+
         elapsedtime = pygame.time.get_ticks() - self.lastticks
-        if elapsedtime < self.frametime:
-            pygame.time.delay(self.frametime - elapsedtime)
+        while elapsedtime < self.frametime:
+            pygame.time.delay(min(self.frametime - elapsedtime, self.inputpoll))
+            self.poll_events()
+            elapsedtime = pygame.time.get_ticks() - self.lastticks
         self.lastticks = pygame.time.get_ticks()
 
 
     def mainloop(self):
         """Main loop of the game. It keeps running until the program finishes.
         """
+        self.profiler and self.profiler.start()
         while self.running:
-            self.handle_user_events()
-            self.handle_timer_events()
-            self.update()
-            self.draw()
+            if self.profiler:
+                self.profiler.profile_frame(self)
+            else:
+                self.handle_user_events()
+                self.handle_timer_events()
+                self.update()
+                self.draw()
             self.delay()
+        self.profiler and self.profiler.stop()
+        self.stop_capture()
         self.currscene and self.currscene.unload()
 
 
@@ -208,6 +412,62 @@ class Scene:
         return self.timers.get(timername)
 
 
+    def load_image(self, resourcename, filename):
+        """Loads an image from the game's asset bundle (or from its file, if
+        not bundled) and adds it as a named resource of the scene.
+        """
+        bundle = self.game.assetbundle
+        if bundle and bundle.contains('image', filename):
+            image = bundle.load_image(filename)
+        else:
+            image = pygame.image.load(filename)
+        if not self.game.headless:
+            image = image.convert_alpha() \
+                if image.get_flags() & pygame.SRCALPHA else image.convert()
+        self.add_resource('image', resourcename, image)
+
+
+    def load_sound(self, resourcename, filename):
+        """Loads a sound from the game's asset bundle (or from its file, if
+        not bundled) and adds it as a named resource of the scene. Headless
+        games skip sounds entirely.
+        """
+        if self.game.headless:
+            return
+        bundle = self.game.assetbundle
+        if bundle and bundle.contains('sound', filename):
+            sound = bundle.load_sound(filename)
+        else:
+            sound = pygame.mixer.Sound(filename)
+        self.add_resource('sound', resourcename, sound)
+
+
+    def load_font(self, resourcename, filename, size):
+        """Loads a font from the game's asset bundle (or from its file, if
+        not bundled) and adds it as a named resource of the scene.
+        """
+        bundle = self.game.assetbundle
+        if bundle and bundle.contains('font', filename):
+            font = bundle.load_font(filename, size)
+        else:
+            font = pygame.font.Font(filename, size)
+        self.add_resource('font', resourcename, font)
+
+
+    def play_sound(self, soundname, channelname=None):
+        """Plays a named sound resource on a named channel of the game, or on
+        any free channel if the game has no such channel.
+        """
+        if self.game.headless:
+            return
+        sound = self.get_resource('sound', soundname)
+        channel = channelname and self.game.get_channel(channelname)
+        if channel:
+            channel.play(sound)
+        else:
+            sound.play()
+
+
     def unload(self):
         """Unloads the scene resources.
         """
@@ -217,15 +477,15 @@ class Scene:
     def handle_timer_events(self):
         """Handles timer events that are specific for the scene.
         """
-        for timername, timer in self.timers.items():
+        for timername, timer in list(self.timers.items()):
             if timer.paused:
                 continue
-            elapsedtime = pygame.time.get_ticks() - timer.lastcall
+            elapsedtime = get_ticks() - timer.lastcall
             if elapsedtime >= timer.interval:
                 timer.callback(timer.arguments) if timer.arguments else \
                     timer.callback()
                 if timername in self.timers:
-                    self.timers[timername].lastcall = pygame.time.get_ticks()
+                    self.timers[timername].lastcall = get_ticks()
 
 
     # Abstract methods --------------------------------------------------------
@@ -271,10 +531,588 @@ class Timer(object):
         self.callback  = callback
         self.arguments = arguments
         self.paused    = False
-        self.lastcall  = pygame.time.get_ticks()
+        self.lastcall  = get_ticks()
 
 
     def toggle_pause(self):
         """Just toggles the paused state of the timer. 
         """
         self.paused = not self.paused
+
+
+
+#______________________________________________________________________________
+
+class SoundChannel(object):
+    """A mixer channel reserved for a single category of sounds. A sound played
+    on it interrupts the previous one instead of piling up on another channel.
+    Sounds requested less than mininterval milliseconds after the last one are
+    dropped while that one is still playing, so effects triggered every few
+    frames are coalesced into a single sound.
+    """
+
+    def __init__(self, channel, mininterval=0):
+        """SoundChannel constructor. It sets the pygame channel and the minimum
+        interval between two consecutive sounds.
+        """
+        super(SoundChannel, self).__init__()
+        self.channel     = channel
+        self.mininterval = mininterval
+        self.lastplay    = -mininterval
+
+
+    def play(self, sound):
+        """Plays a sound on the channel, unless it must be coalesced with the
+        sound that is currently playing.
+        """
+        ticks = get_ticks()
+        if ticks - self.lastplay < self.mininterval and self.channel.get_busy():
+            return
+        self.channel.play(sound)
+        self.lastplay = ticks
+
+
+
+#______________________________________________________________________________
+
+class AssetBundle(object):
+    """A single file packing several assets in pre-decoded form: the raw pixel
+    data of images, the raw PCM samples of sounds (in the mixer format they
+    were packed with) and the bytes of font files. Assets are looked up by the
+    name of the file they were packed from. The bundle is memory-mapped when
+    opened, so no asset is read, decompressed or resampled at load time.
+    The file layout is: a magic string, the size of a JSON index (unsigned 32
+    bits, little endian), the index itself and then the asset data.
+    """
+
+    magic       = b'GBBUNDLE'
+    imageexts   = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tga')
+    soundexts   = ('.wav', '.ogg')
+    fontexts    = ('.ttf', '.otf')
+
+    def __init__(self, filename):
+        """AssetBundle constructor. It maps the bundle file into memory and
+        reads its index.
+        """
+        super(AssetBundle, self).__init__()
+        self.file = open(filename, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        start = len(AssetBundle.magic)
+        if self.data[:start] != AssetBundle.magic:
+            raise ValueError('Not an asset bundle: {}'.format(filename))
+        indexsize, = struct.unpack('<I', self.data[start:start + 4])
+        index = self.data[start + 4:start + 4 + indexsize]
+        self.index = json.loads(index.decode('utf-8'))
+        self.base  = start + 4 + indexsize
+
+
+    def contains(self, assettype, filename):
+        """Tests whether the bundle has a usable asset of the given type packed
+        from the given file. Sounds are only usable if the mixer is running
+        with the same format they were packed with.
+        """
+        entry = self.index.get(filename)
+        if not entry or entry['type'] != assettype:
+            return False
+        if assettype == 'sound':
+            return list(pygame.mixer.get_init() or []) == entry['mixer']
+        return True
+
+
+    def get_buffer(self, filename):
+        """Returns a zero-copy view of the data of a bundled asset (a copy of
+        it on Python 2, whose mmap objects do not support memoryview).
+        """
+        entry = self.index[filename]
+        start = self.base + entry['offset']
+        end   = start + entry['length']
+        try:
+            return memoryview(self.data)[start:end]
+        except TypeError: # Python 2
+            return self.data[start:end]
+
+
+    def load_image(self, filename):
+        """Returns a surface whose pixels are read straight from the bundle.
+        """
+        entry = self.index[filename]
+        return pygame.image.frombuffer(self.get_buffer(filename),
+                                       tuple(entry['size']), entry['format'])
+
+
+    def load_sound(self, filename):
+        """Returns a sound built from the PCM samples stored in the bundle.
+        """
+        return pygame.mixer.Sound(buffer=self.get_buffer(filename))
+
+
+    def load_font(self, filename, size):
+        """Returns a font of the given size parsed from the bundled file.
+        """
+        return pygame.font.Font(io.BytesIO(self.get_buffer(filename)), size)
+
+
+    def close(self):
+        """Unmaps and closes the bundle file.
+        """
+        self.data.close()
+        self.file.close()
+
+
+    @staticmethod
+    def pack(bundlename, filenames):
+        """Packs the given image, sound and font files into a new bundle. The
+        mixer must already be initialized with the format the game will use.
+        """
+        index  = {}
+        chunks = []
+        offset = 0
+        for filename in filenames:
+            ext = os.path.splitext(filename)[1].lower()
+            if ext in AssetBundle.imageexts:
+                image = pygame.image.load(filename)
+                imageformat = 'RGBA' \
+                    if image.get_flags() & pygame.SRCALPHA else 'RGB'
+                data  = pygame.image.tostring(image, imageformat)
+                entry = {'type': 'image', 'size': list(image.get_size()),
+                         'format': imageformat}
+            elif ext in AssetBundle.soundexts:
+                data  = pygame.mixer.Sound(filename).get_raw()
+                entry = {'type': 'sound',
+                         'mixer': list(pygame.mixer.get_init())}
+            elif ext in AssetBundle.fontexts:
+                with open(filename, 'rb') as fontfile:
+                    data = fontfile.read()
+                entry = {'type': 'font'}
+            else:
+                raise ValueError('Unsupported asset file: {}'.format(filename))
+
+            entry.update({'offset': offset, 'length': len(data)})
+            index.update({filename: entry})
+            chunks.append(data)
+            offset += len(data)
+
+        index = json.dumps(index).encode('utf-8')
+        with open(bundlename, 'wb') as bundlefile:
+            bundlefile.write(AssetBundle.magic)
+            bundlefile.write(struct.pack('<I', len(index)))
+            bundlefile.write(index)
+            for data in chunks:
+                bundlefile.write(data)
+
+
+
+#______________________________________________________________________________
+
+class FrameCapture(object):
+    """Captures frames drawn on a surface and writes them to files on a
+    background thread. If the filename has a replacement field (for instance,
+    'frames/{:06d}.png'), every frame is saved as an image named after its
+    index, in the format given by the extension (PNG, BMP, TGA or JPEG).
+    Otherwise, frames are appended to a single file of raw pixels, in the
+    surface's own pixel format (usually 'bgr0', as ffmpeg calls it).
+    Frame pixels are copied once, straight from the surface buffer to one of
+    queuesize preallocated buffers, which images are saved from (this needs
+    pygame 2.1.3 or later, for pygame.image.frombuffer). If all of them are waiting to be written,
+    capturing blocks until one is free. If writing fails, the error is raised
+    by the next capture (or by close).
+    """
+
+    def __init__(self, surface, filename, queuesize=8):
+        """FrameCapture constructor. It allocates the frame buffers and starts
+        the writer thread. The directory of the file is created if needed.
+        """
+        super(FrameCapture, self).__init__()
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.surface  = surface
+        self.filename = filename
+        self.count    = 0
+        self.error    = None
+        self.rawfile  = None if '{' in filename else open(filename, 'wb')
+        self.frames   = queue.Queue(queuesize)
+        self.buffers  = queue.Queue()
+        for _ in range(queuesize):
+            self.buffers.put(bytearray(surface.get_buffer().length))
+
+        self.thread = threading.Thread(target=self.write_frames)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def capture(self, surface=None):
+        """Queues the frame currently drawn on the surface to be written. The
+        game may pass its current screen surface, in case it was replaced by
+        another one of the same size and format (when the window is resized).
+        """
+        self.check()
+        buf = self.buffers.get()
+        buf[:] = (surface or self.surface).get_buffer()
+        self.frames.put((self.count, buf))
+        self.count += 1
+
+
+    def write_frames(self):
+        """Writes queued frames until the capture is closed. It runs on the
+        writer thread. After an error, frames are dropped (their buffers are
+        still freed, so capturing never blocks forever) and the error is kept
+        to be raised on the game's thread.
+        """
+        # Images are saved from surfaces made right on the frame buffers, in
+        # the pixel layout of the captured surface (named after its bytes in
+        # memory, with its unused byte, if any, as alpha).
+        size = self.surface.get_size()
+        masks = self.surface.get_masks()
+        layout = ['A'] * self.surface.get_bytesize()
+        for name, mask in zip('RGB', masks):
+            byte = ((mask & -mask).bit_length() - 1) // 8
+            layout[byte if sys.byteorder == 'little' else -1 - byte] = name
+        layout = ''.join(layout)
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            index, buf = item
+            try:
+                if self.error is None and self.rawfile:
+                    self.rawfile.write(buf)
+                elif self.error is None:
+                    frame = pygame.image.frombuffer(buf, size, layout)
+                    if not masks[3]:
+                        # The unused byte is made opaque, in place.
+                        frame.fill((0, 0, 0, 255), None,
+                                   pygame.BLEND_RGBA_MAX)
+                    pygame.image.save(frame, self.filename.format(index))
+            except Exception as error:
+                self.error = error
+            self.buffers.put(buf)
+
+
+    def check(self):
+        """Raises the error that made writing frames fail, if any.
+        """
+        if self.error is not None:
+            raise self.error
+
+
+    def close(self):
+        """Waits until all queued frames are written and stops the writer.
+        """
+        self.frames.put(None)
+        self.thread.join()
+        self.rawfile and self.rawfile.close()
+        self.check()
+
+
+
+#______________________________________________________________________________
+
+class KeyRepeater(object):
+    """Turns timestamped key presses and releases into actions, repeated while
+    keys are held: an action happens when its key is pressed, again after a
+    delay (DAS, delayed auto shift) and then at a fixed rate (ARR, auto repeat
+    rate), all in milliseconds. Repeats are timed from the presses themselves,
+    not from frames, so they do not depend on the frame rate, and a key tapped
+    for less than a frame still makes its action happen.
+    Keys bound in the same group are mutually exclusive: only the last one
+    pressed (among the held ones) repeats, and the others start their delay
+    over once it is released.
+    """
+
+    def __init__(self):
+        """KeyRepeater constructor. It starts with no key bindings.
+        """
+        super(KeyRepeater, self).__init__()
+        self.bindings = {}
+        self.held     = {}
+        self.actions  = []
+        self.polled   = []
+
+
+    def bind(self, key, action, das, arr=None, group=None):
+        """Binds a key to an action, with the given DAS and ARR (which is the
+        same as the DAS, if not given).
+        """
+        self.bindings[key] = (action, das, das if arr is None else arr, group)
+
+
+    def clear(self):
+        """Removes all key bindings, held keys and pending actions.
+        """
+        self.bindings.clear()
+        self.held.clear()
+        del self.actions[:]
+
+
+    def press(self, key, ticks):
+        """Registers that a key was pressed at the given time, making its
+        action happen.
+        """
+        binding = self.bindings.get(key)
+        if binding is None:
+            return
+        action, das, arr, group = binding
+        self.actions.append((ticks, action))
+        self.held[key] = [ticks + das, ticks]
+
+
+    def release(self, key, ticks):
+        """Registers that a key was released at the given time.
+        """
+        self.held.pop(key, None)
+
+
+    def poll(self, ticks):
+        """Returns the (time, action) pairs that happened up to the given time,
+        sorted by time. The returned list is only valid until the next call,
+        which empties it to collect actions into it again.
+        """
+        actions = self.actions
+        for key, state in self.held.items():
+            action, das, arr, group = self.bindings[key]
+            if group is not None and any(
+                    other != key and self.bindings[other][3] == group and
+                    otherstate[1] > state[1]
+                    for other, otherstate in self.held.items()):
+                state[0] = ticks + das
+                continue
+            while state[0] <= ticks:
+                actions.append((state[0], action))
+                state[0] += arr
+        actions.sort()
+        self.actions, self.polled = self.polled, actions
+        del self.actions[:]
+        return actions
+
+
+
+#______________________________________________________________________________
+
+class LatencyHistogram(object):
+    """Histogram of the latencies (in whole milliseconds) between input events
+    and the presentation of the first frame showing their effects. Latencies
+    of maxlatency milliseconds or more share the last bin.
+    """
+
+    def __init__(self, maxlatency=250):
+        """LatencyHistogram constructor. It preallocates the bins.
+        """
+        super(LatencyHistogram, self).__init__()
+        self.bins    = array.array('l', [0]) * (maxlatency + 1)
+        self.pending = []
+        self.count   = 0
+        self.total   = 0
+
+
+    def mark(self, ticks):
+        """Registers an input event (at the given time) whose effects will be
+        shown in the next frame.
+        """
+        self.pending.append(ticks)
+
+
+    def present(self, ticks):
+        """Records the latencies of the pending input events, given the time
+        when the frame showing their effects was presented.
+        """
+        last = len(self.bins) - 1
+        for inputticks in self.pending:
+            latency = int(ticks - inputticks)
+            self.bins[min(max(latency, 0), last)] += 1
+            self.count += 1
+            self.total += latency
+        del self.pending[:]
+
+
+    def percentile(self, percent):
+        """Returns the latency below or at which the given percentage of the
+        recorded latencies are.
+        """
+        target = self.count * percent / 100.0
+        accum = 0
+        for latency, count in enumerate(self.bins):
+            accum += count
+            if count and accum >= target:
+                return latency
+        return 0
+
+
+    def report(self):
+        """Returns a text summary of the recorded latencies.
+        """
+        if not self.count:
+            return 'No input latencies recorded'
+        return ('Input latency over {} events: mean {:.1f} ms, median {} ms, '
+                '95% {} ms, 99% {} ms, max {}{} ms').format(
+                    self.count, float(self.total) / self.count,
+                    self.percentile(50), self.percentile(95),
+                    self.percentile(99), self.percentile(100),
+                    '+' if self.bins[-1] else '')
+
+
+
+#______________________________________________________________________________
+
+class MemoryProfiler(object):
+    """Profiles the memory allocated by the frame loop of a game with
+    tracemalloc (so it requires Python 3.4 or newer). Every frame, it measures
+    how much memory each phase of the loop (handling user and timer events,
+    updating and drawing) allocates: the peak above what was allocated before
+    the phase (so transient allocations count too) on Python 3.9 or newer, or
+    just the net change on older versions. Every few frames, it
+    takes a snapshot and reports those allocations per frame, the garbage
+    collections run, and which scene methods retained memory since the last
+    snapshot. Memory that keeps growing for several reports in a row is
+    flagged, since in steady state a game loop should not grow at all.
+    """
+
+    phases = ('handle_user_events', 'handle_timer_events', 'update', 'draw')
+
+    def __init__(self, frames=300, growthreports=3, nframes=16, limit=5):
+        """MemoryProfiler constructor. It reports every given number of frames,
+        with the limit scene methods that retained the most memory, and flags
+        growth over growthreports reports in a row. Allocations are traced
+        nframes calls deep, to find the scene methods they come from.
+        """
+        super(MemoryProfiler, self).__init__()
+        if tracemalloc is None:
+            raise RuntimeError('Memory profiling requires tracemalloc '
+                               '(Python 3.4 or newer)')
+        self.frames        = frames
+        self.growthreports = growthreports
+        self.nframes       = nframes
+        self.limit         = limit
+        self.frame         = 0
+        self.allocated     = dict((phase, 0) for phase in self.phases)
+        self.growth        = []
+        self.snapshot      = None
+        self.collections   = None
+        self.methods       = {}
+
+
+    def start(self):
+        """Starts tracing allocations.
+        """
+        tracemalloc.start(self.nframes)
+        self.snapshot = self.take_snapshot()
+        self.collections = self.count_collections()
+
+
+    def stop(self):
+        """Reports the last (partial) profiling period and stops tracing.
+        """
+        if self.frame % self.frames:
+            self.report(None)
+        tracemalloc.stop()
+
+
+    def take_snapshot(self):
+        """Returns a snapshot of the traced memory, without the memory of the
+        profiler itself.
+        """
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, inspect.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>')))
+
+
+    def count_collections(self):
+        """Returns how many garbage collections of each generation have run.
+        """
+        return [stats['collections'] for stats in gc.get_stats()] \
+            if hasattr(gc, 'get_stats') else []
+
+
+    def profile_frame(self, game):
+        """Runs the phases of a frame of the game (all but the delay), measuring
+        the memory they allocate. It reports every few frames.
+        """
+        resetpeak = hasattr(tracemalloc, 'reset_peak')
+        for phase in self.phases:
+            resetpeak and tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            getattr(game, phase)()
+            current, peak = tracemalloc.get_traced_memory()
+            self.allocated[phase] += (peak if resetpeak else current) - before
+        self.frame += 1
+        if self.frame % self.frames == 0:
+            self.report(game.currscene)
+
+
+    def find_method(self, scene, filename, lineno):
+        """Returns the name of the method of the scene's class (or its base
+        classes) whose code is at the given file and line, or None.
+        """
+        cls = type(scene)
+        if cls not in self.methods:
+            spans = []
+            for base in inspect.getmro(cls):
+                for name, member in vars(base).items():
+                    if not inspect.isfunction(member):
+                        continue
+                    try:
+                        lines, first = inspect.getsourcelines(member)
+                    except (IOError, TypeError):
+                        continue
+                    spans.append((member.__code__.co_filename, first,
+                                  first + len(lines),
+                                  base.__name__ + '.' + name))
+            self.methods[cls] = spans
+        for spanfile, first, last, name in self.methods[cls]:
+            if spanfile == filename and first <= lineno < last:
+                return name
+        return None
+
+
+    def report(self, scene):
+        """Prints the allocations per frame of each phase, the garbage
+        collections, and the scene methods that retained the most memory since
+        the last report. Flags steady growth.
+        """
+        frames = self.frame % self.frames or self.frames
+        snapshot = self.take_snapshot()
+        collections = self.count_collections()
+        retained = {}
+        if scene is not None:
+            for stat in snapshot.compare_to(self.snapshot, 'traceback'):
+                if not stat.size_diff:
+                    continue
+                for frame in reversed(list(stat.traceback)):
+                    name = self.find_method(scene, frame.filename,
+                                            frame.lineno)
+                    if name:
+                        retained[name] = retained.get(name, 0) + \
+                            stat.size_diff
+                        break
+        total = sum(stat.size for stat in snapshot.statistics('filename'))
+        previous = sum(stat.size
+                       for stat in self.snapshot.statistics('filename'))
+
+        print('Memory profile of frames {}-{}: {:.1f} KiB traced ({:+.1f} '
+              'KiB)'.format(self.frame - frames + 1, self.frame, total / 1024.0,
+                            (total - previous) / 1024.0))
+        print('  Allocated per frame: ' + ', '.join(
+            '{} {:.2f} KiB'.format(phase, self.allocated[phase] /
+                                   1024.0 / frames)
+            for phase in self.phases))
+        if collections:
+            print('  Garbage collections: ' + ', '.join(
+                'gen{} {}'.format(gen, count - before) for gen, (count, before)
+                in enumerate(zip(collections, self.collections))))
+        top = sorted(retained.items(), key=lambda item: -abs(item[1]))
+        for name, size in top[:self.limit]:
+            print('  Retained by {}: {:+.1f} KiB'.format(name, size / 1024.0))
+
+        self.growth.append(total > previous)
+        del self.growth[:-self.growthreports]
+        if len(self.growth) == self.growthreports and all(self.growth):
+            print('  Warning: traced memory grew in each of the last {} '
+                  'reports'.format(self.growthreports))
+
+        self.snapshot = snapshot
+        self.collections = collections
+        for phase in self.phases:
+            self.allocated[phase] = 0
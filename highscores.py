@@ -0,0 +1,159 @@
+# -*- coding: utf-8
+
+from __future__ import print_function
+import sqlite3, threading, time
+
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+
+#______________________________________________________________________________
+
+class HighScoreStore(object):
+    """Persistent leaderboard and history of gameplay sessions, stored in a
+    SQLite database. The database is only ever touched by a background thread:
+    sessions added by the game are queued and written in batches (one
+    transaction each), after which the cached leaderboards are refreshed. The
+    game reads those cached leaderboards, which never blocks on the database.
+    Leaderboards are kept per grid size and, optionally, per speed level.
+    """
+
+    schema = [
+        '''CREATE TABLE IF NOT EXISTS sessions (
+               id         INTEGER PRIMARY KEY,
+               finished   REAL    NOT NULL,
+               rows       INTEGER NOT NULL,
+               cols       INTEGER NOT NULL,
+               score      INTEGER NOT NULL,
+               lines      INTEGER NOT NULL,
+               level      INTEGER NOT NULL,
+               startlevel INTEGER NOT NULL,
+               elapsed    INTEGER NOT NULL)''',
+        '''CREATE INDEX IF NOT EXISTS sessions_top
+               ON sessions (rows, cols, score DESC)''',
+        '''CREATE INDEX IF NOT EXISTS sessions_level_top
+               ON sessions (rows, cols, level, score DESC)'''
+    ]
+
+    def __init__(self, filename='highscores.db', topsize=10, batchsize=256,
+                 batchdelay=0.5):
+        """HighScoreStore constructor. It starts the writer thread, which
+        opens (or creates) the database. Sessions are written at most
+        batchsize at a time, waiting up to batchdelay seconds to gather them.
+        """
+        super(HighScoreStore, self).__init__()
+        self.filename   = filename
+        self.topsize    = topsize
+        self.batchsize  = batchsize
+        self.batchdelay = batchdelay
+        self.top        = {}
+        self.requests   = queue.Queue()
+
+        self.thread = threading.Thread(target=self.write_sessions)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def add_session(self, gridsize, score, lines, level, startlevel, elapsed):
+        """Queues a finished gameplay session to be stored. It returns right
+        away.
+        """
+        self.requests.put(('session', (time.time(), gridsize[0], gridsize[1],
+                                       score, lines, level, startlevel,
+                                       elapsed)))
+
+
+    def get_top(self, gridsize, level=None):
+        """Returns the cached leaderboard (a list of (score, lines, level,
+        elapsed time) tuples, best first) for a grid size and, optionally, a
+        speed level. The first time a leaderboard is asked for, it is loaded in
+        the background and an empty list is returned meanwhile.
+        """
+        key = (gridsize[0], gridsize[1], level)
+        top = self.top.get(key)
+        if top is None:
+            self.top[key] = top = []
+            self.requests.put(('refresh', key))
+        return top
+
+
+    def get_best_score(self, gridsize, level=None):
+        """Returns the best cached score for a grid size (and speed level), or
+        0 if there is none yet.
+        """
+        top = self.get_top(gridsize, level)
+        return top[0][0] if top else 0
+
+
+    def query_top(self, connection, key):
+        """Queries the leaderboard of a (rows, cols, level) key. It runs on the
+        writer thread.
+        """
+        rows, cols, level = key
+        if level is None:
+            cursor = connection.execute(
+                '''SELECT score, lines, level, elapsed FROM sessions
+                   WHERE rows = ? AND cols = ?
+                   ORDER BY score DESC LIMIT ?''',
+                (rows, cols, self.topsize))
+        else:
+            cursor = connection.execute(
+                '''SELECT score, lines, level, elapsed FROM sessions
+                   WHERE rows = ? AND cols = ? AND level = ?
+                   ORDER BY score DESC LIMIT ?''',
+                (rows, cols, level, self.topsize))
+        return [tuple(row) for row in cursor]
+
+
+    def write_sessions(self):
+        """Writes queued sessions in batches and refreshes the leaderboards,
+        until the store is closed. It runs on the writer thread.
+        """
+        connection = sqlite3.connect(self.filename)
+        for statement in HighScoreStore.schema:
+            connection.execute(statement)
+        connection.commit()
+
+        closing = False
+        while not closing:
+            sessions = []
+            refresh  = set()
+            request  = self.requests.get()
+            deadline = time.time() + self.batchdelay
+            while True:
+                kind, data = request
+                if kind == 'close':
+                    closing = True
+                elif kind == 'refresh':
+                    refresh.add(data)
+                else:
+                    sessions.append(data)
+                if closing or len(sessions) >= self.batchsize:
+                    break
+                try:
+                    request = self.requests.get(
+                        timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+
+            if sessions:
+                with connection:
+                    connection.executemany(
+                        '''INSERT INTO sessions (finished, rows, cols, score,
+                               lines, level, startlevel, elapsed)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', sessions)
+                for session in sessions:
+                    refresh.update(key for key in list(self.top)
+                                   if key[:2] == session[1:3])
+            for key in refresh:
+                self.top[key] = self.query_top(connection, key)
+        connection.close()
+
+
+    def close(self):
+        """Writes all queued sessions and stops the writer thread.
+        """
+        self.requests.put(('close', None))
+        self.thread.join()
@@ -0,0 +1,440 @@
+# -*- coding: utf-8
+
+from __future__ import print_function
+import collections, time
+from tetris import Tetrimino, LEFT, RIGHT, ROTATE, QUICKFALL
+
+
+#______________________________________________________________________________
+
+class SearchTimeout(Exception):
+    """Raised inside the perfect clear search when its time budget runs out.
+    """
+    pass
+
+
+
+#______________________________________________________________________________
+
+class Solver(object):
+    """Finds, for training, the shortest inputs (finesse) to reach every
+    placement of a tetrimino, and perfect clears: sequences of placements of
+    the upcoming tetriminos that leave the grid empty.
+    Both follow the game rules: tetriminos only rotate clockwise, with no wall
+    kicks, and can move sideways at any height (so they can be tucked under
+    overhangs).
+    Perfect clears are searched depth-first over the bottom few rows of the
+    grid (the clear zone), encoded as a single integer with one bit per block,
+    and the placements of a tetrimino are found with shifts of whole boards
+    too. Branches are pruned when the empty blocks in the zone cannot be
+    filled by the tetriminos left: their count is not a multiple of four
+    (parity), their balance between even and odd columns cannot be made by
+    those tetriminos (column parity), some empty region is enclosed, not a
+    multiple of four blocks, or four blocks in a shape none of them has
+    (holes). Searched boards are memoized, with integer keys and results, in a
+    least recently used cache kept across turns, so a search can be spread
+    over several frames and the next turn's search mostly reuses the previous
+    one.
+    """
+
+    extrarows = 4 # empty rows above the zone, where tetriminos come from
+
+    def __init__(self, maxheight=4, cachesize=2**16):
+        """Solver constructor. Perfect clears are searched up to maxheight
+        rows high. The cache keeps the cachesize most recently searched
+        boards.
+        """
+        super(Solver, self).__init__()
+        self.maxheight = maxheight
+        self.cachesize = cachesize
+        self.cache     = collections.OrderedDict()
+        self.tables    = {}
+        self.zones     = {}
+        self.shapes    = {}
+        self.cols      = None
+        self.queue     = None
+        self.code      = 0
+        self.windows   = None
+        self.deadline  = None
+
+
+    # Finesse ----------------------------------------------------------------
+
+    def finesse(self, grid, piece, angle, row, col):
+        """Returns, for every placement reachable by a tetrimino from its
+        current rotation index and position in a TetrisScene grid (with the
+        obstacle border), the fewest inputs that take it there: a dict mapping
+        the placement's blocks (a tuple of grid (row, col) pairs) to the number
+        of moves and rotations needed and the list of actions. Quick falls are
+        free, since the tetrimino falls by itself anyway.
+        """
+        rotations = Tetrimino.cellmap[piece]
+
+        def fits(state):
+            a, r, c = state
+            for i, j in rotations[a]:
+                if grid[r + i][c + j]:
+                    return False
+            return True
+
+        start = (angle, row, col)
+        costs = {start: 0}
+        parents = {start: None}
+        queue = collections.deque([start])
+        placements = {}
+        while queue:
+            state = queue.popleft()
+            a, r, c = state
+            cost = costs[state]
+            below = (a, r + 1, c)
+            if not fits(below):
+                cells = tuple((r + i, c + j) for i, j in rotations[a])
+                if cells not in placements or cost < placements[cells][0]:
+                    placements[cells] = (cost, state)
+            for action, step, stepcost in (
+                    (QUICKFALL, below, 0),
+                    (LEFT, (a, r, c - 1), 1),
+                    (RIGHT, (a, r, c + 1), 1),
+                    (ROTATE, ((a + 1) % 4, r, c), 1)):
+                if step in costs and costs[step] <= cost + stepcost:
+                    continue
+                if not fits(step):
+                    continue
+                costs[step] = cost + stepcost
+                parents[step] = (state, action)
+                # 0-1 breadth first search: free steps go first.
+                queue.appendleft(step) if stepcost == 0 else queue.append(step)
+
+        result = {}
+        for cells, (cost, state) in placements.items():
+            actions = []
+            while parents[state]:
+                state, action = parents[state]
+                actions.append(action)
+            actions.reverse()
+            result[cells] = (cost, actions)
+        return result
+
+
+    # Perfect clears ---------------------------------------------------------
+
+    def encode(self, grid, height):
+        """Returns the encoding of the bottom height rows of a TetrisScene grid
+        (without the border) as an integer, with bit row*cols + col set for
+        every block (rows counted from the bottom), or None if there are blocks
+        above those rows.
+        """
+        rows, cols = len(grid) - 2, len(grid[0]) - 2
+        board = 0
+        for k in range(rows):
+            row = grid[rows - k]
+            for j in range(cols):
+                if row[j + 1]:
+                    if k >= height:
+                        return None
+                    board |= 1 << (k*cols + j)
+        return board
+
+
+    def zone_masks(self, height, cols):
+        """Returns the masks of a zone: all its blocks, those not in its left
+        or right column, those of its top row and those of its even columns.
+        """
+        key = (height, cols)
+        masks = self.zones.get(key)
+        if masks is None:
+            zone = (1 << (height*cols)) - 1
+            leftcol = sum(1 << (k*cols) for k in range(height))
+            masks = (zone, zone & ~leftcol, zone & ~(leftcol << (cols - 1)),
+                     ((1 << cols) - 1) << ((height - 1)*cols),
+                     sum(leftcol << j for j in range(0, cols, 2)))
+            self.zones[key] = masks
+        return masks
+
+
+    def piece_table(self, height, cols, piece):
+        """Returns the tables used to find the placements of a tetrimino with
+        shifts of whole boards. A position is the bit of the bottom left
+        corner of the tetrimino's bounding box, in the encoding of the zone
+        extended by extrarows rows above it. For every rotation index, the
+        table holds the bit offsets of the blocks, their mask at position 0,
+        the positions within the columns, those above the zone (where the
+        tetrimino comes from), those within the zone, those that can rotate
+        and how far the rotation shifts them, and the lower rotation index
+        with the same blocks (or None). It also holds the positions not in
+        the left or right column.
+        """
+        key = (height, cols, piece)
+        table = self.tables.get(key)
+        if table is not None:
+            return table
+
+        rows = height + self.extrarows
+        rotations = Tetrimino.cellmap[piece]
+        boxes = [(max(i for i, j in cells), min(j for i, j in cells),
+                  max(i for i, j in cells) - min(i for i, j in cells) + 1,
+                  max(j for i, j in cells) - min(j for i, j in cells) + 1)
+                 for cells in rotations]
+
+        def positions(test):
+            return sum(1 << (y*cols + x) for y in range(rows)
+                       for x in range(cols) if test(y, x))
+
+        entries = []
+        masks = []
+        for a, cells in enumerate(rotations):
+            bottom, left, tall, wide = boxes[a]
+            offsets = [(bottom - i)*cols + j - left for i, j in cells]
+            mask = sum(1 << offset for offset in offsets)
+            # The rotation keeps the tetrimino matrix in place, so it moves
+            # the corner of the bounding box by the difference of the boxes.
+            nextbottom, nextleft, nexttall, nextwide = boxes[(a + 1) % 4]
+            dy, dx = bottom - nextbottom, nextleft - left
+            entries.append((
+                offsets, mask,
+                positions(lambda y, x: x + wide <= cols),
+                positions(lambda y, x: x + wide <= cols and y >= height),
+                positions(lambda y, x: x + wide <= cols and
+                          y + tall <= height),
+                positions(lambda y, x: x + wide <= cols and 0 <= y + dy < rows
+                          and 0 <= x + dx and x + dx + nextwide <= cols),
+                dy*cols + dx,
+                masks.index(mask) if mask in masks else None))
+            masks.append(mask)
+        table = (entries, positions(lambda y, x: x > 0),
+                 positions(lambda y, x: x < cols - 1))
+        self.tables[key] = table
+        return table
+
+
+    def placements(self, board, height, cols, piece):
+        """Returns the placements of a tetrimino in the clear zone that it can
+        reach coming from above, one per distinct set of blocks, all in the
+        zone: a sorted list of their positions (see piece_table) shifted left
+        by two bits, with the rotation index in those bits.
+        """
+        entries, notleft, notright = self.piece_table(height, cols, piece)
+        free = []
+        for entry in entries:
+            blocked = 0
+            for offset in entry[0]:
+                blocked |= board >> offset
+            free.append(entry[2] & ~blocked)
+
+        # Flood fill the positions reached in every rotation index (moving
+        # sideways and falling), then rotate them into the next one, until no
+        # new position is reached.
+        reached = [entry[3] & fits for entry, fits in zip(entries, free)]
+        grown = True
+        while grown:
+            for a in range(4):
+                reach, fits = reached[a], free[a]
+                while True:
+                    spread = (reach | (reach & notleft) >> 1 |
+                              (reach & notright) << 1 | reach >> cols) & fits
+                    if spread == reach:
+                        break
+                    reach = spread
+                reached[a] = reach
+            grown = False
+            for a in range(4):
+                b = (a + 1) % 4
+                turned = reached[a] & entries[a][5]
+                shift = entries[a][6]
+                turned = turned << shift if shift >= 0 else turned >> -shift
+                turned &= free[b] & ~reached[b]
+                if turned:
+                    reached[b] |= turned
+                    grown = True
+
+        # The tetrimino rests where it cannot fall any further.
+        resting = [reach & entry[4] & ~(fits << cols)
+                   for reach, entry, fits in zip(reached, entries, free)]
+        for a, entry in enumerate(entries):
+            if entry[7] is not None:
+                resting[entry[7]] |= resting[a]
+                resting[a] = 0
+        result = []
+        for a, rest in enumerate(resting):
+            while rest:
+                low = rest & -rest
+                result.append((low.bit_length() - 1) << 2 | a)
+                rest ^= low
+        result.sort()
+        return result
+
+
+    def prepare(self, pieces, cols):
+        """Sets up the searches of a sequence of tetrimino ids in zones of the
+        given width: its encoding (three bits per id, the first one lowest),
+        the column balances and kinds of tetriminos of its every window, and
+        the shapes of the tetriminos. The cache is emptied for a new width.
+        """
+        if cols != self.cols:
+            self.cols = cols
+            self.cache.clear()
+            self.shapes.clear()
+            # Every shape, shifted to its lowest block, with the tetriminos
+            # that have it (one bit per id).
+            for piece, rotations in Tetrimino.cellmap.items():
+                for cells in rotations:
+                    bottom = max(i for i, j in cells)
+                    left = min(j for i, j in cells)
+                    mask = sum(1 << ((bottom - i)*cols + j - left)
+                               for i, j in cells)
+                    mask >>= (mask & -mask).bit_length() - 1
+                    self.shapes[mask] = self.shapes.get(mask, 0) | 1 << piece
+        self.queue = pieces
+        self.code = sum(piece << 3*k for k, piece in enumerate(pieces))
+
+        # Column balance (even minus odd blocks, halved) that every tetrimino
+        # can make: line clears do not move blocks across columns, so the
+        # tetriminos filling the zone must make the balance of its empty
+        # blocks.
+        halves = dict(
+            (piece, set(sign*sum(1 - 2*(j % 2) for i, j in cells)//2
+                        for cells in rotations for sign in (1, -1)))
+            for piece, rotations in Tetrimino.cellmap.items())
+        self.windows = []
+        for k in range(len(pieces) + 1):
+            balances, kinds = set([0]), 0
+            window = [(frozenset(balances), kinds)]
+            for piece in pieces[k:]:
+                balances = set(b + h for b in balances for h in halves[piece])
+                kinds |= 1 << piece
+                window.append((frozenset(balances), kinds))
+            self.windows.append(window)
+
+
+    def prune(self, board, height, k, n):
+        """Tests whether the empty blocks of the zone cannot be filled by the
+        n tetriminos of the queue from index k on: by column parity (see
+        prepare) or because of holes (empty regions enclosed, not made of a
+        multiple of four blocks, or of four blocks in a shape none of the
+        tetriminos has).
+        """
+        cols = self.cols
+        zone, notleft, notright, toprow, evencols = \
+            self.zone_masks(height, cols)
+        empty = zone & ~board
+        balances, kinds = self.windows[k][n]
+        if (bin(empty & evencols).count('1') -
+                bin(empty & ~evencols).count('1')) // 2 not in balances:
+            return True
+
+        # Flood fill the empty regions (4-connected, within the zone) with
+        # shifts of whole boards.
+        while empty:
+            region = empty & -empty
+            while True:
+                grown = region | (region << cols) | (region >> cols) | \
+                        ((region << 1) & notleft) | ((region >> 1) & notright)
+                grown &= empty
+                if grown == region:
+                    break
+                region = grown
+            count = bin(region).count('1')
+            if count % 4 or not region & toprow:
+                return True
+            if count == 4 and not kinds & self.shapes.get(
+                    region >> (region & -region).bit_length() - 1, 0):
+                return True
+            empty &= ~region
+        return False
+
+
+    def clear(self, board, height, cols):
+        """Removes the complete rows of the zone, returning the new board and
+        height.
+        """
+        full = (1 << cols) - 1
+        k = 0
+        while k < height:
+            if board >> (k*cols) & full == full:
+                low = board & ((1 << (k*cols)) - 1)
+                board = low | (board >> ((k + 1)*cols) << (k*cols))
+                height -= 1
+            else:
+                k += 1
+        return board, height
+
+
+    def search(self, board, height, k):
+        """Searches a perfect clear of the zone with the tetriminos of the
+        queue from index k on (not all of them need to be used). Returns 0 if
+        there is none, or else the number of tetriminos of the solution
+        shifted left by 18 bits, with its first placement (see placements) in
+        those bits.
+        """
+        cols = self.cols
+        empty = height*cols - bin(board).count('1')
+        n = empty // 4
+        if empty % 4 or k + n > len(self.queue) or \
+           self.prune(board, height, k, n):
+            return 0
+        # Only the tetriminos that fit in the zone matter, so the next turns,
+        # which see more upcoming tetriminos, still find this board cached.
+        # The bit above their codes keeps keys of different lengths apart.
+        key = ((((1 << 3*n) | (self.code >> 3*k & ((1 << 3*n) - 1))) << 8 |
+                height) << (self.maxheight*cols)) | board
+        result = self.cache.pop(key, None)
+        if result is not None:
+            self.cache[key] = result
+            return result
+        if time.time() > self.deadline:
+            raise SearchTimeout()
+
+        result = 0
+        piece = self.queue[k]
+        entries = self.piece_table(height, cols, piece)[0]
+        for placement in self.placements(board, height, cols, piece):
+            mask = entries[placement & 3][1] << (placement >> 2)
+            newboard, newheight = self.clear(board | mask, height, cols)
+            if newheight == 0:
+                result = 1 << 18 | placement
+                break
+            rest = self.search(newboard, newheight, k + 1)
+            if rest:
+                result = ((rest >> 18) + 1) << 18 | placement
+                break
+        self.cache[key] = result
+        if len(self.cache) > self.cachesize:
+            self.cache.popitem(last=False)
+        return result
+
+
+    def perfect_clear(self, grid, pieces, budget=None):
+        """Searches a perfect clear of a TetrisScene grid (with the obstacle
+        border) with the given sequence of upcoming tetrimino ids (the current
+        one first), within budget seconds, if given. Returns the blocks (grid
+        (row, col) pairs) of the first placement and the number of tetriminos
+        of the shortest solution found, False if there is no perfect clear
+        within the maximum height, or None if the budget ran out first (the
+        search goes on where it left off when called again). Lower zones are
+        searched first, so the search deepens one row at a time.
+        """
+        rows, cols = len(grid) - 2, len(grid[0]) - 2
+        pieces = tuple(pieces)
+        if pieces != self.queue or cols != self.cols:
+            self.prepare(pieces, cols)
+        self.deadline = time.time() + budget if budget is not None \
+            else float('inf')
+
+        for height in range(1, min(self.maxheight, rows) + 1):
+            board = self.encode(grid, height)
+            if board is None or (height*cols - bin(board).count('1')) % 4:
+                continue
+            try:
+                result = self.search(board, height, 0)
+            except SearchTimeout:
+                return None
+            if result:
+                placement = result & ((1 << 18) - 1)
+                entries = self.piece_table(height, cols, pieces[0])[0]
+                mask = entries[placement & 3][1] << (placement >> 2)
+                # Zone row 0 is the bottom one, right above the grid's bottom
+                # border.
+                cells = tuple((rows - b // cols, b % cols + 1)
+                              for b in range(height*cols) if mask >> b & 1)
+                return cells, result >> 18
+        return False
@@ -0,0 +1,193 @@
+# -*- coding: utf-8
+
+from __future__ import print_function
+import array, json, os, time
+
+
+#______________________________________________________________________________
+
+class Telemetry(object):
+    """Gameplay metrics recorder. Per piece, it records the piece id, the times
+    it spawned and locked, the number of moves, rotations and quick falls made
+    with it, the number of lines it cleared and the score it yielded. Records
+    are kept in fixed-size ring buffers allocated up front (the oldest ones are
+    overwritten when they are full), so recording an event never allocates.
+    All times are in milliseconds of gameplay (not including paused time).
+    """
+
+    # Column names and array typecodes of the per-piece records.
+    columns = [
+        ('pieceid',    'b'),
+        ('spawntime',  'i'),
+        ('locktime',   'i'),
+        ('moves',      'H'),
+        ('rotations',  'H'),
+        ('quickfalls', 'H'),
+        ('lines',      'B'),
+        ('scoredelta', 'i')
+    ]
+
+    magic = b'JATCTELE'
+
+    def __init__(self, capacity=4096, actioncapacity=1024, exportdir=None):
+        """Telemetry constructor. It preallocates the per-piece ring buffers
+        (capacity records) and the ring buffer of action times used for the
+        actions per minute (actioncapacity records). If exportdir is given,
+        the records of each gameplay are exported there when it is over (the
+        directory is created if needed).
+        """
+        super(Telemetry, self).__init__()
+        self.capacity       = capacity
+        self.actioncapacity = actioncapacity
+        self.exportdir      = exportdir
+        self.data           = {}
+        for name, typecode in Telemetry.columns:
+            self.data[name] = array.array(typecode, [0]) * capacity
+        self.actiontimes    = array.array('i', [0]) * actioncapacity
+        self.reset()
+
+        if exportdir and not os.path.isdir(exportdir):
+            os.makedirs(exportdir)
+
+
+    def reset(self):
+        """Forgets all records, for a new gameplay.
+        """
+        self.count       = 0
+        self.actioncount = 0
+        self.pieceid     = 0
+        self.spawntime   = 0
+        self.spawnscore  = 0
+        self.moves       = 0
+        self.rotations   = 0
+        self.quickfalls  = 0
+
+
+    def spawn(self, pieceid, ticks, score):
+        """Starts recording a newly spawned piece.
+        """
+        self.pieceid    = pieceid
+        self.spawntime  = ticks
+        self.spawnscore = score
+        self.moves      = 0
+        self.rotations  = 0
+        self.quickfalls = 0
+
+
+    def action(self, ticks):
+        """Records the time of a player action.
+        """
+        self.actiontimes[self.actioncount % self.actioncapacity] = ticks
+        self.actioncount += 1
+
+
+    def move(self, ticks):
+        """Records a successful move of the current piece.
+        """
+        self.moves += 1
+        self.action(ticks)
+
+
+    def rotate(self, ticks):
+        """Records a successful rotation of the current piece.
+        """
+        self.rotations += 1
+        self.action(ticks)
+
+
+    def quickfall(self, ticks):
+        """Records a quick fall of the current piece.
+        """
+        self.quickfalls += 1
+        self.action(ticks)
+
+
+    def lock(self, ticks, lines, score):
+        """Stores the record of the current piece, which has just been attached
+        to the grid.
+        """
+        i = self.count % self.capacity
+        data = self.data
+        data['pieceid'][i]    = self.pieceid
+        data['spawntime'][i]  = self.spawntime
+        data['locktime'][i]   = ticks
+        data['moves'][i]      = self.moves
+        data['rotations'][i]  = self.rotations
+        data['quickfalls'][i] = self.quickfalls
+        data['lines'][i]      = lines
+        data['scoredelta'][i] = score - self.spawnscore
+        self.count += 1
+
+
+    def pieces_per_second(self, ticks, window=10000):
+        """Returns the number of pieces locked per second over the last window
+        milliseconds (or since the beginning of the gameplay, if shorter).
+        """
+        locktimes = self.data['locktime']
+        oldest = max(self.count - self.capacity, 0)
+        count = 0
+        i = self.count - 1
+        while i >= oldest and ticks - locktimes[i % self.capacity] < window:
+            count += 1
+            i -= 1
+        span = min(ticks, window)
+        return 1000.0 * count / span if span > 0 else 0.0
+
+
+    def actions_per_minute(self, ticks, window=60000):
+        """Returns the number of actions per minute over the last window
+        milliseconds (or since the beginning of the gameplay, if shorter).
+        """
+        oldest = max(self.actioncount - self.actioncapacity, 0)
+        count = 0
+        i = self.actioncount - 1
+        while i >= oldest and \
+              ticks - self.actiontimes[i % self.actioncapacity] < window:
+            count += 1
+            i -= 1
+        span = min(ticks, window)
+        return 60000.0 * count / span if span > 0 else 0.0
+
+
+    def export(self, filename=None):
+        """Writes the per-piece records, oldest first, to a columnar file: a
+        magic string, a line of JSON describing the columns and then the
+        contents of each column, one after the other. If no filename is given,
+        a new file is created in the export directory. Returns the filename.
+        """
+        if filename is None:
+            filename = os.path.join(self.exportdir, 'telemetry-{}.bin'.format(
+                int(time.time() * 1000)))
+
+        count = min(self.count, self.capacity)
+        start = self.count % self.capacity if self.count > self.capacity else 0
+        header = {
+            'count': count,
+            'columns': [[name, typecode, self.data[name].itemsize]
+                        for name, typecode in Telemetry.columns]
+        }
+        with open(filename, 'wb') as outfile:
+            outfile.write(Telemetry.magic)
+            outfile.write(json.dumps(header).encode('utf-8') + b'\n')
+            for name, _ in Telemetry.columns:
+                column = self.data[name]
+                column[start:count].tofile(outfile)
+                column[:start].tofile(outfile)
+        return filename
+
+
+    @staticmethod
+    def load(filename):
+        """Reads a file written by export, returning a dict with one array per
+        column.
+        """
+        with open(filename, 'rb') as infile:
+            if infile.read(len(Telemetry.magic)) != Telemetry.magic:
+                raise ValueError('Not a telemetry file: {}'.format(filename))
+            header = json.loads(infile.readline().decode('utf-8'))
+            columns = {}
+            for name, typecode, _ in header['columns']:
+                column = array.array(typecode)
+                column.fromfile(infile, header['count'])
+                columns[name] = column
+        return columns
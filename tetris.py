@@ -1,7 +1,7 @@
 # -*- coding: utf-8
 
 from __future__ import print_function
-import os, random, pygame, gamebasics
+import json, os, random, pygame, gamebasics, highscores, telemetry
 
 
 #______________________________________________________________________________
@@ -17,15 +17,47 @@ colormap = {
     8: (105, 105, 105)  # (gray) obstacles or screen bounds
 }
 
+# Codes of the gameplay actions, as performed by TetrisScene.perform. In
+# replays, NOOP marks the end of each frame and TICK the timed updates.
+NOOP, LEFT, RIGHT, ROTATE, QUICKFALL, TICK = range(6)
+
+# Intervals (in milliseconds) between timed updates at each speed level.
+speedintervals = [500, 400, 300, 200, 150, 100, 75, 50, 25, 10]
+
+# Frames per second of the game (a fixed-step game advances its clock by
+# 1000 // framerate milliseconds per frame).
+framerate = 30
+
+# Same format as the WAV files (so they are never resampled) and a small
+# buffer, for low latency sound effects.
+mixerconfig = {'frequency': 22050, 'size': -16, 'channels': 2, 'buffer': 512}
+
+# Assets loaded by the gameplay scene, which can be packed into a single bundle
+# (python tetris.py pack) for a faster startup.
+bundlefile = 'assets.bundle'
+assetfiles = {
+    'BgImage'    : os.path.join('images', 'bg.png'),
+    'TitleFont'  : os.path.join('fonts', 'thirteen-pixel-fonts.regular.ttf'),
+    'LabelFont'  : os.path.join('fonts', 'pixel-millennium.regular.ttf'),
+    'CrashSound' : os.path.join('sound', 'crash.wav'),
+    'PauseSound' : os.path.join('sound', 'pause.wav'),
+    'RotateSound': os.path.join('sound', 'rotate.wav'),
+    'ScoreSound' : os.path.join('sound', 'score.wav')
+}
+
 
 #______________________________________________________________________________
 
-class Tetrimino:
+class Tetrimino(object):
     """A letter-shaped piece composed of four colored blocks. In total, there
     are seven types of tetriminos, defined by their shapes and colors:
     I (cyan), J (blue), L (orange), O (gold), S (green), T (magenta), Z (red).
+    Tetriminos have slots instead of a dict, and are reset to be reused rather
+    than created for every spawn.
     """
 
+    __slots__ = ('id', 'angle', 'row', 'col', 'matrix', 'cells')
+
     matrixmap = {
         # 'I' shaped tetrimino.
         1:[[[0,0,0,0,0],
@@ -187,11 +219,19 @@ class Tetrimino:
         """Tetrimino constructor. Sets the data matrix according to the given
         id and also places the tetrimino at its initial position.
         """
+        self.reset(id, middle)
+
+
+    def reset(self, id, middle=5):
+        """Turns the tetrimino into a new one of the given id, at its initial
+        position.
+        """
         self.id     = id
         self.angle  = 0
         self.row    = 0
         self.col    = middle - 1
         self.matrix = Tetrimino.matrixmap[self.id]
+        self.cells  = Tetrimino.cellmap[self.id]
 
 
     def move(self, direction):
@@ -219,6 +259,14 @@ class Tetrimino:
             self.angle = (self.angle - 90) % 360
 
 
+# Blocks (row, col) filled by each tetrimino id at each rotation index, so they
+# can be visited without scanning (and allocating ranges over) the matrices.
+Tetrimino.cellmap = dict(
+    (_id, [tuple((i, j) for i in range(5) for j in range(5) if _matrix[i][j])
+           for _matrix in _rotations])
+    for _id, _rotations in Tetrimino.matrixmap.items())
+
+
 
 #______________________________________________________________________________
 
@@ -226,8 +274,11 @@ class TetrisScene(gamebasics.Scene, object):
     """Scene subclass specifically built for controlling the Tetris gameplay.
     """
 
-    def __init__(self, game, gridsize=(20, 10)):
-        """See the docs for gamebasics.Scene.__init__.
+    def __init__(self, game, gridsize=(20, 10), telemetry=None,
+                 transitions=None):
+        """See the docs for gamebasics.Scene.__init__. Gameplay metrics are
+        recorded into the given telemetry.Telemetry object, if any, and one
+        transition per frame into the given transitions.TransitionRecorder.
         """
         super(TetrisScene, self).__init__(game)
         
@@ -239,39 +290,81 @@ class TetrisScene(gamebasics.Scene, object):
         self.paused         = False
         self.currtetri      = None
         self.nexttetri      = None
-        self.movedelay      = 0
-        self.movedelaymax   = 3
-        self.falldelay      = 0
-        self.falldelaymax   = 2
-        self.rotatedelay    = 0
-        self.rotatedelaymax = 4
+        self.movedas        = 100
+        self.movearr        = 100
+        self.falldas        = 67
+        self.fallarr        = 67
+        self.rotatedas      = 133
+        self.rotatearr      = 133
         self.refertime      = 0
         self.accumtime      = 0
         self.currmusic      = 1
         self.musics         = []
         self.grid           = None
+        self.emptyrow       = None
+        self.innersize      = None
+        self.labels         = {}
+        self.blockrect      = pygame.Rect(0, 0, 0, 0)
+        self.nextsquare     = pygame.Rect(75, 95, 125, 190)
+        self.gridsquare     = pygame.Rect(274, 24, 251, 501)
+        self.telemetry      = telemetry
+        self.random         = random.Random()
+        self.seed           = None
+        self.startlevel     = 1
+        self.record         = None
+        self.recordfile     = None
+        self.replay         = None
+        self.transitions    = transitions
+        self.frameaction    = NOOP
+        self.framescore     = 0
+        self.autoplayer     = None
+        self.highscores     = None
+        self.plan           = []
+        self.plannedtetri   = None
+        self.solver         = None
+        self.hinttetri      = None
+        self.hintqueue      = None
+        self.hint           = None
+        self.hintbudget     = 0.008
+        self.hintframes     = 0
+        self.rivals         = None
+        self.rivalspos      = (550, 24)
+        self.finessetable   = None
+        self.inputs         = 0
+        self.faults         = 0
 
         # pygame.key.set_repeat(1, 75)
 
 
-    def newgame(self, speedlevel=1):
+    def newgame(self, speedlevel=1, seed=None):
         """Begins a new gameplay. Initializes the statistics (score, speed
         level, etc), builds an empty grid (with obstacles at the corners) and
-        sets a timer which regularly calls the update method.
+        sets a timer which regularly calls the update method. The sequence of
+        tetriminos is drawn from a random generator with the given seed (or a
+        random one, if not given).
         """
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.random.seed(self.seed)
+        if self.record is not None:
+            del self.record[:]
+
+        self.startlevel  = speedlevel
         self.speedlevel  = speedlevel
         self.score       = 0
         self.lines       = 0
         self.running     = True
         self.paused      = False
-        self.movedelay   = 0
-        self.falldelay   = 0
-        self.rotatedelay = 0
+        self.frameaction = NOOP
+        self.framescore  = 0
+        self.hinttetri   = None
+        self.faults      = 0
 
-        middle = (self.gridsize[1] - 2) / 2
-        self.currtetri  = Tetrimino(random.randint(1, 7), middle)
-        self.nexttetri  = Tetrimino(random.randint(1, 7), middle)
+        middle = (self.gridsize[1] - 2) // 2
+        self.currtetri  = Tetrimino(random_tetrimino(self.random), middle)
+        self.nexttetri  = Tetrimino(random_tetrimino(self.random), middle)
 
+        self.innersize = self.gridsize[0] - 2, self.gridsize[1] - 2
+        self.emptyrow  = [0] * self.innersize[1]
         self.grid = [0] * self.gridsize[0]
         for i in range(self.gridsize[0]):
             self.grid[i] = [0] * self.gridsize[1]
@@ -280,12 +373,17 @@ class TetrisScene(gamebasics.Scene, object):
                    j == 0 or j == self.gridsize[1] - 1:
                     self.grid[i][j] = 8 # obstacle block
 
-        pygame.mixer.music.play(-1)
+        if not self.game.headless:
+            pygame.mixer.music.play(-1)
 
         self.set_speedlevel(self.speedlevel)
-        self.refertime = pygame.time.get_ticks()
+        self.refertime = gamebasics.get_ticks()
         self.accumtime = 0
 
+        if self.telemetry:
+            self.telemetry.reset()
+            self.telemetry.spawn(self.currtetri.id, 0, 0)
+
 
     def toggle_pause(self):
         """Pauses/unpauses the gameplay.
@@ -293,14 +391,14 @@ class TetrisScene(gamebasics.Scene, object):
         if self.running:
             self.paused = not self.paused
             self.get_timer('TimedUpdate').toggle_pause()
-            self.get_resource('sound', 'PauseSound').play()
+            self.play_sound('PauseSound', 'ui')
 
             if self.paused:
-                self.accumtime += pygame.time.get_ticks() - self.refertime
-                pygame.mixer.music.pause()
+                self.accumtime += gamebasics.get_ticks() - self.refertime
+                self.game.headless or pygame.mixer.music.pause()
             else:
-                self.refertime = pygame.time.get_ticks()
-                pygame.mixer.music.unpause()
+                self.refertime = gamebasics.get_ticks()
+                self.game.headless or pygame.mixer.music.unpause()
 
 
     def switch_music(self, inc):
@@ -318,7 +416,157 @@ class TetrisScene(gamebasics.Scene, object):
         """Returns the time elapsed since the beginning of the gameplay (not
         including paused time).
         """
-        return pygame.time.get_ticks() - self.refertime + self.accumtime
+        return gamebasics.get_ticks() - self.refertime + self.accumtime
+
+
+    def start_recording(self, filename=None):
+        """Starts recording every action performed in each gameplay, so it can
+        be saved as a replay. If a filename is given, the replay is saved there
+        at game over.
+        """
+        self.record     = bytearray()
+        self.recordfile = filename
+
+
+    def save_replay(self, filename):
+        """Saves the recorded actions of the current (or last) gameplay to a
+        replay file, along with what is needed to play them back.
+        """
+        replay = {
+            'gridsize'  : [self.gridsize[0] - 2, self.gridsize[1] - 2],
+            'speedlevel': self.startlevel,
+            'seed'      : self.seed,
+            'actions'   : ''.join(str(action) for action in self.record)
+        }
+        with open(filename, 'w') as replayfile:
+            json.dump(replay, replayfile)
+
+
+    def start_replay(self, filename):
+        """Begins a new gameplay which plays back the actions of a replay file
+        instead of the player's ones. Timed updates are played back too, so the
+        replay is the same whatever the frame rate or timer accuracy.
+        """
+        with open(filename) as replayfile:
+            replay = json.load(replayfile)
+        self.gridsize = replay['gridsize'][0] + 2, replay['gridsize'][1] + 2
+        self.record = None
+        self.newgame(replay['speedlevel'], replay['seed'])
+        self.replay = iter([int(action) for action in replay['actions']])
+        self.get_timer('TimedUpdate').paused = True
+
+
+    def play_replay_frame(self):
+        """Performs the replay actions of the current frame. The game quits
+        when the replay is over.
+        """
+        for action in self.replay:
+            if action == NOOP:
+                return
+            self.perform(action)
+        self.replay = None
+        self.game.quit()
+
+
+    def perform(self, action):
+        """Performs a gameplay action given by its code: move left or right,
+        rotate, quick fall or the timed update.
+        """
+        if action != TICK:
+            self.frameaction = action
+            if self.solver and action != QUICKFALL:
+                self.inputs += 1
+            if self.record is not None:
+                self.record.append(action)
+
+        if action == LEFT:
+            self.move(-1)
+        elif action == RIGHT:
+            self.move(1)
+        elif action == ROTATE:
+            self.rotate()
+        elif action == QUICKFALL:
+            self.quickfall()
+        elif action == TICK:
+            self.timedupdate()
+
+
+    def autoplay(self):
+        """Performs the next action planned by the autoplayer for the current
+        tetrimino (planning them first, for a new tetrimino).
+        """
+        t = self.currtetri
+        if self.plannedtetri is not t:
+            self.plan = self.autoplayer.plan(self.grid, t.id, t.angle // 90,
+                                             t.row, t.col)
+            self.plan.reverse()
+            self.plannedtetri = t
+        if self.plan:
+            self.perform(self.plan.pop())
+
+
+    def upcoming(self, count):
+        """Returns the ids of the current tetrimino and the upcoming ones (up
+        to count in total), peeking at the tetrimino sequence with a copy of
+        the random generator.
+        """
+        peek = random.Random()
+        peek.setstate(self.random.getstate())
+        return [self.currtetri.id, self.nexttetri.id] + \
+               [random_tetrimino(peek) for _ in range(count - 2)]
+
+
+    def update_hint(self):
+        """Updates the training hints of the current tetrimino: for a new one,
+        the finesse (fewest inputs) of all its placements, and the first
+        placement of a perfect clear with the upcoming tetriminos, if any. The
+        perfect clear search takes at most hintbudget seconds per frame, and
+        goes on in the next frames until it finishes, for up to two seconds
+        of gameplay: past that, the hint would come too late to be of use (and
+        the searches that long are nearly all those finding no perfect clear).
+        """
+        t = self.currtetri
+        if self.hinttetri is not t:
+            self.hinttetri = t
+            self.finessetable = self.solver.finesse(
+                self.grid, t.id, t.angle // 90, t.row, t.col)
+            self.hintqueue = self.upcoming(11)
+            self.hintframes = 2*framerate
+            self.hint = None
+            self.inputs = 0
+        if self.hintqueue:
+            result = self.solver.perfect_clear(self.grid, self.hintqueue,
+                                               self.hintbudget)
+            self.hintframes -= 1
+            if result is not None:
+                self.hint = result or None
+                self.hintqueue = None
+            elif not self.hintframes:
+                self.hintqueue = None
+
+
+    def check_finesse(self):
+        """Counts the inputs (moves and rotations) used to place the current
+        tetrimino beyond the fewest possible as finesse faults.
+        """
+        t = self.currtetri
+        cells = tuple((t.row + i, t.col + j) for i, j in t.cells[t.angle // 90])
+        best = self.finessetable and self.finessetable.get(cells)
+        if best:
+            self.faults += max(self.inputs - best[0], 0)
+
+
+    def record_transition(self, done):
+        """Records the transition of the current frame: the state reached, the
+        last action performed in the frame, the score gained and whether the
+        game is over.
+        """
+        t = self.currtetri
+        self.transitions.record(
+            self.grid, t.id, self.nexttetri.id, (t.row, t.col, t.angle // 90),
+            self.frameaction, self.score - self.framescore, done)
+        self.frameaction = NOOP
+        self.framescore  = self.score
 
 
     def timedupdate(self):
@@ -328,9 +576,13 @@ class TetrisScene(gamebasics.Scene, object):
         etc. The number of times this method is called per second depends on
         the game's speed level.
         """
+        if self.record is not None:
+            self.record.append(TICK)
+
         self.currtetri.fall()
         if self.collision():
             self.currtetri.row -= 1
+            self.solver and self.check_finesse()
             self.attach()
 
             boundmin = max(self.currtetri.row, 1)
@@ -348,16 +600,24 @@ class TetrisScene(gamebasics.Scene, object):
                 self.lines += len(completed)
                 if self.lines >= 12*self.speedlevel - 2:
                     self.set_speedlevel(self.speedlevel + 1)
-                self.get_resource('sound', 'ScoreSound').play()
+                self.play_sound('ScoreSound', 'board')
             else:
-                self.get_resource('sound', 'CrashSound').play()
+                self.play_sound('CrashSound', 'board')
+
+            self.telemetry and self.telemetry.lock(
+                self.get_elapsed_time(), len(completed), self.score)
 
             if self.game_is_lost():
                 self.gameover()
             else:
-                middle = (self.gridsize[1] - 2) / 2
+                # The locked tetrimino is reused as the next one.
+                middle = (self.gridsize[1] - 2) // 2
+                locked = self.currtetri
                 self.currtetri = self.nexttetri
-                self.nexttetri = Tetrimino(random.randint(1, 7), middle)
+                self.nexttetri = locked
+                locked.reset(random_tetrimino(self.random), middle)
+                self.telemetry and self.telemetry.spawn(
+                    self.currtetri.id, self.get_elapsed_time(), self.score)
 
 
     def move(self, direction):
@@ -367,6 +627,8 @@ class TetrisScene(gamebasics.Scene, object):
         self.currtetri.move(direction)
         if self.collision():
             self.currtetri.move(-direction)
+        else:
+            self.telemetry and self.telemetry.move(self.get_elapsed_time())
 
 
     def quickfall(self):
@@ -375,6 +637,7 @@ class TetrisScene(gamebasics.Scene, object):
         self.currtetri.fall()
         if self.collision():
             self.currtetri.row -= 1
+        self.telemetry and self.telemetry.quickfall(self.get_elapsed_time())
 
         # while not self.collision():
         #     self.currtetri.fall()
@@ -389,7 +652,8 @@ class TetrisScene(gamebasics.Scene, object):
         if self.collision():
             self.currtetri.rotate(False)
         else:
-            self.get_resource('sound', 'RotateSound').play()
+            self.play_sound('RotateSound', 'piece')
+            self.telemetry and self.telemetry.rotate(self.get_elapsed_time())
 
 
     def collision(self):
@@ -397,11 +661,10 @@ class TetrisScene(gamebasics.Scene, object):
         block of the grid.
         """
         t = self.currtetri
-        a = t.angle / 90
-        for i in range(5):
-            for j in range(5):
-                if t.matrix[a][i][j] and self.grid[i + t.row][j + t.col]:
-                    return True
+        grid = self.grid
+        for i, j in t.cells[t.angle // 90]:
+            if grid[i + t.row][j + t.col]:
+                return True
         return False
 
 
@@ -419,9 +682,12 @@ class TetrisScene(gamebasics.Scene, object):
         """Removes all blocks from completed rows and sends all blocks above
         one position below.
         """
+        # The cleared row list is emptied and reused as the new top row.
+        cleared = self.grid[row]
         for i in range(row, 1, -1):
             self.grid[i] = self.grid[i - 1]
-        self.grid[1] = [8] + [0]*(self.gridsize[1] - 2) + [8]
+        cleared[1:-1] = self.emptyrow
+        self.grid[1] = cleared
 
 
     def find_consecutives(self, sortedlist):
@@ -448,18 +714,15 @@ class TetrisScene(gamebasics.Scene, object):
         """Attaches the current tetrimino's blocks to the grid.
         """
         t = self.currtetri
-        a = t.angle / 90
-        for i in range(5):
-            for j in range(5):
-                if t.matrix[a][i][j]:
-                    self.grid[i + t.row][j + t.col] = t.id
+        for i, j in t.cells[t.angle // 90]:
+            self.grid[i + t.row][j + t.col] = t.id
 
 
     def set_speedlevel(self, speedlevel):
         """Sets a new speed level and adjust the timer interval.
         """
         self.speedlevel = speedlevel
-        interv = [500, 400, 300, 200, 150, 100, 75, 50, 25, 10]
+        interv = speedintervals
 
         timer = self.get_timer('TimedUpdate')
         if timer:
@@ -485,54 +748,74 @@ class TetrisScene(gamebasics.Scene, object):
         self.paused  = False
         self.running = False
         self.del_timer('TimedUpdate')
-        pygame.mixer.music.fadeout(1000)
+        self.game.headless or pygame.mixer.music.fadeout(1000)
         print('Game Over')
 
+        if self.telemetry and self.telemetry.exportdir:
+            self.telemetry.export()
+        if self.record is not None and self.recordfile:
+            self.save_replay(self.recordfile)
+        if self.transitions:
+            self.record_transition(True)
+            self.transitions.flush()
+        self.highscores and self.highscores.add_session(
+            (self.gridsize[0] - 2, self.gridsize[1] - 2), self.score,
+            self.lines, self.speedlevel, self.startlevel,
+            self.get_elapsed_time())
+        self.game.headless and self.game.quit()
+
 
     # Overridden methods -----------------------------------------------------
 
     def load(self):
         """See the docs for gamebasics.Scene.load.
         """
-        filename = os.path.join('images', 'bg.png')
-        bgimage = pygame.image.load(filename)
-        self.add_resource('image', 'BgImage', bgimage)
-
-        filename = os.path.join('fonts', 'thirteen-pixel-fonts.regular.ttf')
-        titlefont = pygame.font.Font(filename, 54)
-        self.add_resource('font', 'TitleFont', titlefont)
-
-        filename = os.path.join('fonts', 'pixel-millennium.regular.ttf')
-        labelfont = pygame.font.Font(filename, 32)
-        self.add_resource('font', 'LabelFont', labelfont)
-
-        filename = os.path.join('sound', 'crash.wav')
-        crashsound = pygame.mixer.Sound(filename)
-        self.add_resource('sound', 'CrashSound', crashsound)
-
-        filename = os.path.join('sound', 'pause.wav')
-        pausesound = pygame.mixer.Sound(filename)
-        self.add_resource('sound', 'PauseSound', pausesound)
-
-        filename = os.path.join('sound', 'rotate.wav')
-        rotatesound = pygame.mixer.Sound(filename)
-        self.add_resource('sound', 'RotateSound', rotatesound)
-
-        filename = os.path.join('sound', 'score.wav')
-        scoresound = pygame.mixer.Sound(filename)
-        self.add_resource('sound', 'ScoreSound', scoresound)
+        self.load_image('BgImage', assetfiles['BgImage'])
+        self.load_font('TitleFont', assetfiles['TitleFont'], 54)
+        self.load_font('LabelFont', assetfiles['LabelFont'], 32)
+        self.load_sound('CrashSound', assetfiles['CrashSound'])
+        self.load_sound('PauseSound', assetfiles['PauseSound'])
+        self.load_sound('RotateSound', assetfiles['RotateSound'])
+        self.load_sound('ScoreSound', assetfiles['ScoreSound'])
 
         self.musics = ['', # no music
                        os.path.join('music', 'Tetris1.mp3'),
                        os.path.join('music', 'Tetris2.mp3')]
-        filename = self.musics[self.currmusic]
-        pygame.mixer.music.load(filename)
+        if not self.game.headless:
+            pygame.mixer.music.load(self.musics[self.currmusic])
+
+        # Held keys repeat their actions after a delay and then at a fixed
+        # rate (both in milliseconds), and only the last horizontal direction
+        # pressed moves the tetrimino.
+        keys = self.game.keys
+        keys.bind(pygame.K_LEFT, LEFT, self.movedas, self.movearr,
+                  'horizontal')
+        keys.bind(pygame.K_RIGHT, RIGHT, self.movedas, self.movearr,
+                  'horizontal')
+        keys.bind(pygame.K_DOWN, QUICKFALL, self.falldas, self.fallarr)
+        keys.bind(pygame.K_UP, ROTATE, self.rotatedas, self.rotatearr)
+
+
+    def unload(self):
+        """See the docs for gamebasics.Scene.unload.
+        """
+        super(TetrisScene, self).unload()
+        self.game.keys.clear()
+        self.transitions and self.transitions.close()
+        self.highscores and self.highscores.close()
+        self.rivals and self.rivals.close()
 
 
     def handle_user_events(self, events):
-        """See the docs for gamebasics.Scene.handle_user_events.
+        """See the docs for gamebasics.Scene.handle_user_events. Gameplay
+        actions come from the key repeater, timestamped when their keys were
+        pressed (or repeated), which is also when their latencies are measured
+        from.
         """
-        if not self.running:
+        # Actions are taken every frame, even if they are discarded, so they
+        # do not pile up while paused, autoplaying or replaying.
+        actions = self.game.keys.poll(gamebasics.get_ticks())
+        if not self.running or self.replay:
             return
 
         for event in events:
@@ -544,58 +827,49 @@ class TetrisScene(gamebasics.Scene, object):
                         self.switch_music(1)
                     elif event.key == pygame.K_n:
                         self.switch_music(-1)
-                # elif event.key == pygame.K_UP:
-                #     self.currtetri.rotate()
-                # elif event.key == pygame.K_DOWN:
-                #     self.quickfall()
-                # elif event.key == pygame.K_LEFT:
-                #     self.currtetri.move(-1)
-                # elif event.key == pygame.K_RIGHT:
-                #     self.currtetri.move(1)
-
-        if not self.paused:
-            pressed = pygame.key.get_pressed()
-            if pressed[pygame.K_UP]:
-                if self.rotatedelay == 0:
-                    self.rotate()
-                    self.rotatedelay = self.rotatedelaymax
-                self.rotatedelay -= 1
-            elif pressed[pygame.K_DOWN]:
-                if self.falldelay == 0:
-                    self.quickfall()
-                    self.falldelay = self.falldelaymax
-                self.falldelay -= 1
-            elif pressed[pygame.K_LEFT] and not pressed[pygame.K_RIGHT]:
-                if self.movedelay == 0:
-                    self.move(-1)
-                    self.movedelay = self.movedelaymax
-                self.movedelay -= 1
-            elif pressed[pygame.K_RIGHT] and not pressed[pygame.K_LEFT]:
-                if self.movedelay == 0:
-                    self.move(1)
-                    self.movedelay = self.movedelaymax
-                self.movedelay -= 1
+
+        if self.paused:
+            return
+        if self.autoplayer:
+            self.autoplay()
+            return
+        for ticks, action in actions:
+            if not self.running:
+                break
+            self.perform(action)
+            self.game.latency.mark(ticks)
 
 
     def update(self):
         """See the docs for gamebasics.Scene.update.
         """
-        pass # Nothing to be done since we only need to update the game logic
-             # when the timer events happen.
+        # Apart from replays, nothing to be done since we only need to update
+        # the game logic when the timer events happen.
+        if not self.running or self.paused:
+            return
+        if self.replay:
+            self.play_replay_frame()
+        elif self.record is not None:
+            self.record.append(NOOP)
+        if self.running and self.transitions:
+            self.record_transition(False)
+        if self.running and self.solver:
+            self.update_hint()
+        if self.running and self.rivals:
+            self.rivals.update()
 
 
     def draw(self):
-        """See the docs for gamebasics.Scene.draw.
+        """See the docs for gamebasics.Scene.draw. Nothing is allocated per
+        frame: rects are reused and labels are only rendered again when their
+        values change.
         """
         if not self.running or self.paused:
             return
         
-        blockrect = pygame.Rect(
-            0,                          # x
-            0,                          # y
-            300 / self.gridsize[1] - 1, # width
-            550 / self.gridsize[0] - 1  # height
-        )
+        blockrect = self.blockrect
+        blockrect.width  = 300 // self.gridsize[1] - 1
+        blockrect.height = 550 // self.gridsize[0] - 1
         black = (  0,   0,   0)
         white = (255, 255, 255)
 
@@ -604,61 +878,40 @@ class TetrisScene(gamebasics.Scene, object):
         
         # Draw the background.
         bgimage = self.get_resource('image', 'BgImage')
-        self.game.screen.blit(bgimage, bgimage.get_rect())
+        self.game.screen.blit(bgimage, (0, 0))
 
         # Draw the title label.
-        titlefont = self.get_resource('font', 'TitleFont')
-        titlesurf = titlefont.render('JATC', True, white)
-        xpos = (275 - titlesurf.get_width()) / 2
-        self.game.screen.blit(titlesurf, (xpos, 10))
+        self.draw_label('TitleFont', 10, 'JATC')
+
+        # Draw the high score label (read from the leaderboard cache).
+        if self.highscores:
+            best = self.highscores.get_best_score(self.innersize)
+            self.draw_label('LabelFont', 68, best, 'HI {}'.format)
         # titlesurf1 = titlefont.render('TETRIS', True, white)
-        # xpos = (275 - titlesurf1.get_width()) / 2
+        # xpos = (275 - titlesurf1.get_width()) // 2
         # self.game.screen.blit(titlesurf1, (xpos, 5))
         # titlesurf2 = titlefont.render('CLONE', True, white)
-        # xpos = (275 - titlesurf2.get_width()) / 2
+        # xpos = (275 - titlesurf2.get_width()) // 2
         # self.game.screen.blit(titlesurf2, (xpos, 50))
 
         # Draw the next tetrimino label.
-        labelfont = self.get_resource('font', 'LabelFont')
-        nextsurf = labelfont.render('NEXT', True, white)
-        xpos = (275 - nextsurf.get_width()) / 2
-        self.game.screen.blit(nextsurf, (xpos, 100))
+        self.draw_label('LabelFont', 100, 'NEXT')
 
         # Draw the score labels.
-        scoresurf1 = labelfont.render('SCORE', True, white)
-        xpos = (275 - scoresurf1.get_width()) / 2
-        self.game.screen.blit(scoresurf1, (xpos, 305))
-
-        scoresurf2 = labelfont.render(str(self.score), True, white)
-        xpos = (275 - scoresurf2.get_width()) / 2
-        self.game.screen.blit(scoresurf2, (xpos, 340))
+        self.draw_label('LabelFont', 305, 'SCORE')
+        self.draw_label('LabelFont', 340, self.score)
 
         # Draw the speed level labels.
-        levelsurf1 = labelfont.render('LEVEL', True, white)
-        xpos = (275 - levelsurf1.get_width()) / 2
-        self.game.screen.blit(levelsurf1, (xpos, 385))
-
-        levelsurf2 = labelfont.render(str(self.speedlevel), True, white)
-        xpos = (275 - levelsurf2.get_width()) / 2
-        self.game.screen.blit(levelsurf2, (xpos, 420))
+        self.draw_label('LabelFont', 385, 'LEVEL')
+        self.draw_label('LabelFont', 420, self.speedlevel)
 
         # Draw the time labels.
-        timesurf1 = labelfont.render('TIME', True, white)
-        xpos = (275 - timesurf1.get_width()) / 2
-        self.game.screen.blit(timesurf1, (xpos, 465))
-
-        milliseconds = self.get_elapsed_time()
-        hours        = milliseconds / 3600000 % 24
-        minutes      = milliseconds / 60000 % 60
-        seconds      = milliseconds / 1000 % 60
-        formattime   = '{:02d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
-
-        timesurf2 = labelfont.render(formattime, True, white)
-        xpos = (275 - timesurf2.get_width()) / 2
-        self.game.screen.blit(timesurf2, (xpos, 500))
+        self.draw_label('LabelFont', 465, 'TIME')
+        self.draw_label('LabelFont', 500, self.get_elapsed_time() // 1000,
+                        format_time)
 
         # Draw the next tetrimino background square.
-        square = pygame.Rect(75, 95, 125, 190)
+        square = self.nextsquare
         pygame.draw.rect(self.game.screen, black, square, 0)
         pygame.draw.rect(self.game.screen, white, square, 1)
 
@@ -671,42 +924,66 @@ class TetrisScene(gamebasics.Scene, object):
         #             blockrect.y = i * (blockrect.height + 1)
         #             pygame.draw.rect(self.game.screen, blockcolor, blockrect)
 
+        # Draw the finesse faults (in training) at the bottom of the square.
+        if self.solver:
+            self.draw_label('LabelFont', 252, self.faults, 'FIN {}'.format)
+
         # Draw the grid background square.
-        square = pygame.Rect(274, 24, 251, 501)
+        square = self.gridsquare
         pygame.draw.rect(self.game.screen, black, square, 0)
         pygame.draw.rect(self.game.screen, white, square, 1)
 
         # Draw the grid blocks.
         for i in range(1, self.gridsize[0] - 1):
+            row = self.grid[i]
             for j in range(1, self.gridsize[1] - 1):
-                if self.grid[i][j]:
-                    blockcolor = colormap[self.grid[i][j]]
+                if row[j]:
+                    blockcolor = colormap[row[j]]
                     blockrect.x = j * (blockrect.width + 1) + 250
                     blockrect.y = i * (blockrect.height + 1)
                     pygame.draw.rect(self.game.screen, blockcolor, blockrect)
 
         # Draw the current tetrimino.
         t = self.currtetri
-        a = t.angle / 90
-        for i in range(5):
-            for j in range(5):
-                if t.matrix[a][i][j]:
-                    blockcolor  = colormap[t.id]
-                    blockrect.x = (j + t.col) * (blockrect.width + 1) + 250
-                    blockrect.y = (i + t.row) * (blockrect.height + 1)
-                    pygame.draw.rect(self.game.screen, blockcolor, blockrect)
+        blockcolor = colormap[t.id]
+        for i, j in t.cells[t.angle // 90]:
+            blockrect.x = (j + t.col) * (blockrect.width + 1) + 250
+            blockrect.y = (i + t.row) * (blockrect.height + 1)
+            pygame.draw.rect(self.game.screen, blockcolor, blockrect)
+
+        # Draw the training hint: the outline of the perfect clear placement.
+        if self.hint:
+            for i, j in self.hint[0]:
+                blockrect.x = j * (blockrect.width + 1) + 250
+                blockrect.y = i * (blockrect.height + 1)
+                pygame.draw.rect(self.game.screen, white, blockrect, 2)
 
         # Draw the next tetrimino.
         blockrect.width = blockrect.height = 24
         t = self.nexttetri
-        a = t.angle / 90
-        for i in range(5):
-            for j in range(5):
-                if t.matrix[a][i][j]:
-                    blockcolor  = colormap[t.id]
-                    blockrect.x = j * (blockrect.width + 1)  + 75
-                    blockrect.y = i * (blockrect.height + 1) + 130
-                    pygame.draw.rect(self.game.screen, blockcolor, blockrect)
+        blockcolor = colormap[t.id]
+        for i, j in t.cells[t.angle // 90]:
+            blockrect.x = j * (blockrect.width + 1)  + 75
+            blockrect.y = i * (blockrect.height + 1) + 130
+            pygame.draw.rect(self.game.screen, blockcolor, blockrect)
+
+        # Draw the thumbnails of the rival boards, right of the grid.
+        if self.rivals:
+            self.rivals.draw(self.game.screen, self.rivalspos)
+
+
+    def draw_label(self, fontname, ypos, value, formatter=str):
+        """Draws a label, centered on the left panel at the given height, with
+        the text of a value (as given by formatter). The rendered label is kept
+        until the value shown at that height changes.
+        """
+        label = self.labels.get(ypos)
+        if label is None or label[0] != value:
+            font = self.get_resource('font', fontname)
+            surface = font.render(formatter(value), True, (255, 255, 255))
+            label = (value, surface, ((275 - surface.get_width()) // 2, ypos))
+            self.labels[ypos] = label
+        self.game.screen.blit(label[1], label[2])
 
 
 
@@ -717,26 +994,192 @@ class TetrisGame(gamebasics.Game, object):
     gameplay itself), but later a title/menu screen might be included too.
     """
 
-    def __init__(self, gridsize):
-        """See the docs for gamebasics.Game.__init__.
+    def __init__(self, gridsize, headless=False, telemetrydir=None,
+                 recordfile=None, replayfile=None, capturefile=None,
+                 transitionsdir=None, autoplay=None, highscoresfile=None,
+                 windowsize=None, fullscreen=False, integerscale=False,
+                 memprofile=0, training=False, rivals=0):
+        """See the docs for gamebasics.Game.__init__. If telemetrydir is
+        given, gameplay metrics are recorded and exported there at game over.
+        If recordfile is given, the gameplay is saved there as a replay at game
+        over. If replayfile is given, that replay is played back instead (as
+        fast as possible, if headless). If capturefile is given, every frame is
+        captured there (see gamebasics.FrameCapture). If transitionsdir is
+        given, the gameplay transitions are appended to the dataset there (see
+        transitions.TransitionRecorder, which requires NumPy). If autoplay is
+        given, the game is played by the autoplayer, with the weights saved in
+        that tuner checkpoint file (or the default ones, if it is empty). If
+        highscoresfile is given, every gameplay session is stored in that
+        SQLite database, whose best score is shown. The 550x550 screen is
+        scaled to the given windowsize, or to the whole display in fullscreen
+        (only by whole factors, with integerscale). If memprofile is not 0, the
+        memory allocated by the frame loop is reported every memprofile frames.
+        In training, the placement starting a perfect clear (if any) is hinted
+        and finesse faults are counted (see solver.Solver). If rivals is not
+        0, that many boards played by the autoplayer are shown as thumbnails
+        right of the grid, on a wider screen (see thumbnails.RivalBoards).
         """
+        # The thumbnails of the rivals (40x80, 4 pixels apart) are laid out in
+        # columns of six, as high as the grid, with the same margin as it.
+        columns = (rivals + 5) // 6
         super(TetrisGame, self).__init__(
             title='Just Another Tetris Clone',
-            screensize=(550, 550),
-            framerate=30)
-        
-        self.add_scene('gameplay', TetrisScene(self, gridsize))
+            screensize=(550 + columns*44 + 21 if rivals else 550, 550),
+            framerate=framerate,
+            mixerconfig=mixerconfig,
+            headless=headless,
+            assetbundle=bundlefile,
+            fixedstep=headless,
+            windowsize=windowsize,
+            fullscreen=fullscreen,
+            integerscale=integerscale,
+            memprofile=memprofile)
+
+        # Every category of sound effects plays on its own reserved channel.
+        # Rotations can happen every few frames, so their sounds are coalesced.
+        self.add_channel('ui')
+        self.add_channel('board')
+        self.add_channel('piece', mininterval=150)
+
+        if replayfile:
+            # Replays are played back in the grid they were recorded in.
+            with open(replayfile) as replay:
+                gridsize = tuple(json.load(replay)['gridsize'])
+
+        stats = telemetry.Telemetry(exportdir=telemetrydir) \
+            if telemetrydir else None
+        recorder = None
+        if transitionsdir:
+            import transitions # Imported only if needed, since it uses NumPy.
+            recorder = transitions.TransitionRecorder(transitionsdir, gridsize)
+        self.add_scene('gameplay',
+                       TetrisScene(self, gridsize, stats, recorder))
         self.goto_scene('gameplay')
-        self.currscene.newgame()
+
+        if highscoresfile:
+            self.currscene.highscores = \
+                highscores.HighScoreStore(highscoresfile)
+
+        if autoplay is not None:
+            import autoplayer # Imported only if needed, like the transitions.
+            self.currscene.autoplayer = autoplayer.AutoPlayer.load(autoplay) \
+                if autoplay else autoplayer.AutoPlayer()
+
+        if training:
+            import solver # Imported only if needed, like the autoplayer.
+            self.currscene.solver = solver.Solver()
+
+        if rivals:
+            import thumbnails # Imported only if needed, like the autoplayer.
+            self.currscene.rivals = thumbnails.RivalBoards(rivals, gridsize,
+                                                           columns)
+
+        if replayfile:
+            self.currscene.start_replay(replayfile)
+        else:
+            recordfile and self.currscene.start_recording(recordfile)
+            self.currscene.newgame()
+        capturefile and self.start_capture(capturefile)
 
 
 #______________________________________________________________________________
 
 
-if __name__ == '__main__':
-    import sys
+def random_tetrimino(generator):
+    """Draws a tetrimino id (1 to 7) from a random.Random generator. Unlike
+    randint, whose algorithm differs between Python 2 and 3, it draws the same
+    sequence on every interpreter, so seeded games and replays match.
+    """
+    return 1 + int(generator.random() * 7)
 
-    gridrows = int(sys.argv[1]) if len(sys.argv) > 1 else 20
-    gridcols = int(sys.argv[2]) if len(sys.argv) > 2 else 10
 
-    TetrisGame((gridrows, gridcols)).start()
+def format_time(seconds):
+    """Formats a time in seconds as hours, minutes and seconds (HH:MM:SS).
+    """
+    return '{:02d}:{:02d}:{:02d}'.format(seconds // 3600 % 24,
+                                         seconds // 60 % 60, seconds % 60)
+
+
+def pack_assets():
+    """Packs the assets of the gameplay scene into the bundle file, with the
+    sounds decoded in the game's mixer format.
+    """
+    pygame.mixer.init(**mixerconfig)
+    gamebasics.AssetBundle.pack(bundlefile, sorted(assetfiles.values()))
+    pygame.mixer.quit()
+
+
+#______________________________________________________________________________
+
+
+if __name__ == '__main__':
+    import argparse, sys
+
+    if sys.argv[1:] == ['pack']:
+        pack_assets()
+        sys.exit()
+
+    parser = argparse.ArgumentParser(description='Just Another Tetris Clone')
+    parser.add_argument('gridrows', type=int, nargs='?', default=20)
+    parser.add_argument('gridcols', type=int, nargs='?', default=10)
+    parser.add_argument('--telemetry', metavar='DIR',
+                        help='export gameplay metrics to DIR at game over')
+    parser.add_argument('--record', metavar='FILE',
+                        help='save the gameplay to FILE as a replay')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='play back the replay saved in FILE')
+    parser.add_argument('--autoplay', metavar='WEIGHTS', nargs='?', const='',
+                        help='let the autoplayer play, with the weights in '
+                             'the WEIGHTS tuner checkpoint, if given')
+    parser.add_argument('--highscores', metavar='FILE',
+                        help='store the sessions and show the high score in '
+                             'the SQLite database FILE')
+    parser.add_argument('--window', metavar='WxH',
+                        type=lambda size: tuple(map(int, size.split('x'))),
+                        help='window size (the game is scaled to fit)')
+    parser.add_argument('--fullscreen', action='store_true')
+    parser.add_argument('--integer-scale', action='store_true',
+                        help='scale the game only by whole factors')
+    parser.add_argument('--headless', action='store_true',
+                        help='play the replay (or autoplay) with no window or '
+                             'audio, as fast as possible')
+    parser.add_argument('--capture', metavar='FILE',
+                        help='capture frames to FILE (raw pixels) or to an '
+                             'image sequence, if FILE is a pattern such as '
+                             'frames/{:06d}.png')
+    parser.add_argument('--transitions', metavar='DIR',
+                        help='append the gameplay transitions to the dataset '
+                             'in DIR')
+    parser.add_argument('--memprofile', metavar='FRAMES', type=int,
+                        default=0,
+                        help='report the memory allocated by the frame loop '
+                             'every FRAMES frames (requires Python 3.4+)')
+    parser.add_argument('--training', action='store_true',
+                        help='hint perfect clears and count finesse faults')
+    parser.add_argument('--rivals', metavar='N', type=int, default=0,
+                        help='show N boards played by the autoplayer')
+    parser.add_argument('--latency', action='store_true',
+                        help='print the keypress to display latencies on exit')
+    args = parser.parse_args()
+    if args.headless and not args.replay and args.autoplay is None:
+        parser.error('--headless requires --replay or --autoplay')
+    if args.memprofile and gamebasics.tracemalloc is None:
+        parser.error('--memprofile requires tracemalloc (Python 3.4+)')
+
+    game = TetrisGame((args.gridrows, args.gridcols),
+                      headless=args.headless,
+                      telemetrydir=args.telemetry,
+                      recordfile=args.record,
+                      replayfile=args.replay,
+                      capturefile=args.capture,
+                      transitionsdir=args.transitions,
+                      autoplay=args.autoplay,
+                      highscoresfile=args.highscores,
+                      windowsize=args.window,
+                      fullscreen=args.fullscreen,
+                      integerscale=args.integer_scale,
+                      memprofile=args.memprofile,
+                      training=args.training,
+                      rivals=args.rivals)
+    game.start()
+    args.latency and print(game.latency.report())
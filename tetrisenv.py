@@ -0,0 +1,448 @@
+# -*- coding: utf-8
+
+from __future__ import print_function
+import math, random
+from tetris import Tetrimino, speedintervals, framerate, random_tetrimino, \
+    LEFT, RIGHT, ROTATE, QUICKFALL, TICK
+
+try:
+    import numpy as np
+except ImportError: # Only the environments need NumPy, not TetrisEngine.
+    np = None
+
+
+#______________________________________________________________________________
+
+# The cells of Tetrimino.cellmap as an array indexed by [id, rotation, cell,
+# (row, col)], or None without NumPy.
+piecearray = None
+if np is not None:
+    piecearray = np.zeros((8, 4, 4, 2), dtype=np.intp)
+    for _id, _rotations in Tetrimino.cellmap.items():
+        piecearray[_id] = _rotations
+
+# Number of frames between timed updates at each speed level, as in the game
+# with a fixed step: its clock advances 1000 // framerate milliseconds per
+# frame and a timer fires once its whole interval has elapsed. The update
+# happens in the frame after the last one of the interval, once its action has
+# been performed (at frames 16, 32, 48... of a game at 500 ms).
+tickframes = [int(math.ceil(interval / float(1000 // framerate)))
+              for interval in speedintervals]
+
+# Score bonus for clearing a run of 1, 2, 3 or 4 consecutive rows.
+rowbonus = [0, 100, 400, 900, 2000]
+
+nactions = 5 # NOOP, LEFT, RIGHT, ROTATE and QUICKFALL
+
+
+#______________________________________________________________________________
+
+class TetrisEngine(object):
+    """The Tetris rules of TetrisScene without pygame, timers or drawing, for
+    simulations. The grid is the same list of lists (with the obstacle border),
+    but the current tetrimino is kept as plain attributes (id, rotation index,
+    row and column) and collisions only test its four filled cells.
+    """
+
+    def __init__(self, gridsize=(20, 10), seed=None):
+        """TetrisEngine constructor. It begins a new game right away.
+        """
+        super(TetrisEngine, self).__init__()
+        self.gridsize = gridsize[0] + 2, gridsize[1] + 2
+        self.random   = random.Random()
+        self.reset(seed)
+
+
+    def reset(self, seed=None, speedlevel=1):
+        """Begins a new game, just like TetrisScene.newgame. Given the same
+        seed, both draw the same sequence of tetriminos.
+        """
+        rows, cols = self.gridsize
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.random.seed(self.seed)
+
+        # TetrisScene's timer starts with the interval of the next speed level
+        # and only gets the one of the current level at the first level up.
+        self.speedlevel = speedlevel
+        self.ticklevel  = min(speedlevel + 1, len(speedintervals))
+        self.score      = 0
+        self.lines      = 0
+        self.lost       = False
+        self.spawncol   = (cols - 2) // 2 - 1
+        self.piece      = random_tetrimino(self.random)
+        self.nextpiece  = random_tetrimino(self.random)
+        self.angle      = 0
+        self.row        = 0
+        self.col        = self.spawncol
+        self.grid       = [[8] * cols] + \
+                          [[8] + [0] * (cols - 2) + [8]
+                           for _ in range(rows - 2)] + \
+                          [[8] * cols]
+
+
+    def collides(self, angle, row, col):
+        """Tests whether the current tetrimino would collide with any block of
+        the grid at the given rotation and position.
+        """
+        grid = self.grid
+        for i, j in Tetrimino.cellmap[self.piece][angle]:
+            if grid[row + i][col + j]:
+                return True
+        return False
+
+
+    def move(self, direction):
+        """See the docs for TetrisScene.move.
+        """
+        if not self.collides(self.angle, self.row, self.col + direction):
+            self.col += direction
+
+
+    def rotate(self):
+        """See the docs for TetrisScene.rotate.
+        """
+        angle = (self.angle + 1) % 4
+        if not self.collides(angle, self.row, self.col):
+            self.angle = angle
+
+
+    def quickfall(self):
+        """See the docs for TetrisScene.quickfall.
+        """
+        if not self.collides(self.angle, self.row + 1, self.col):
+            self.row += 1
+
+
+    def tick(self):
+        """See the docs for TetrisScene.timedupdate.
+        """
+        if not self.collides(self.angle, self.row + 1, self.col):
+            self.row += 1
+            return
+
+        grid = self.grid
+        for i, j in Tetrimino.cellmap[self.piece][self.angle]:
+            grid[self.row + i][self.col + j] = self.piece
+
+        rows, cols = self.gridsize
+        completed = [i for i in range(max(self.row, 1),
+                                      min(self.row + 5, rows - 1))
+                     if 0 not in grid[i]]
+        if completed:
+            run = 1
+            for k in range(1, len(completed) + 1):
+                if k < len(completed) and completed[k] == completed[k-1] + 1:
+                    run += 1
+                else:
+                    self.score += rowbonus[min(run, 4)]
+                    run = 1
+            for i in reversed(completed):
+                del grid[i]
+            for _ in completed:
+                grid.insert(1, [8] + [0] * (cols - 2) + [8])
+
+            self.lines += len(completed)
+            if self.lines >= 12*self.speedlevel - 2:
+                self.speedlevel += 1
+                self.ticklevel = min(self.speedlevel, len(speedintervals))
+
+        if any(grid[1][1:cols-1]):
+            self.lost = True
+        else:
+            self.piece     = self.nextpiece
+            self.nextpiece = random_tetrimino(self.random)
+            self.angle     = 0
+            self.row       = 0
+            self.col       = self.spawncol
+
+
+    def perform(self, action):
+        """See the docs for TetrisScene.perform.
+        """
+        if action == LEFT:
+            self.move(-1)
+        elif action == RIGHT:
+            self.move(1)
+        elif action == ROTATE:
+            self.rotate()
+        elif action == QUICKFALL:
+            self.quickfall()
+        elif action == TICK:
+            self.tick()
+
+
+
+#______________________________________________________________________________
+
+class TetrisEnv(object):
+    """Environment with a reset/step interface (in the style of OpenAI Gym)
+    around the Tetris rules. Every step performs one action (NOOP, LEFT, RIGHT,
+    ROTATE or QUICKFALL) and then advances one frame of a 30 fps game, where
+    the timed update happens at the same frames as in the game (see
+    tickframes and TetrisEngine.ticklevel). The reward is the score gained in
+    the step.
+    Observations are dicts with the grid of settled blocks (without the
+    obstacle border), the ids of the current and next tetriminos and the
+    current tetrimino's position as (row, column, rotation index).
+    """
+
+    nactions = nactions
+
+    def __init__(self, gridsize=(20, 10), seed=None):
+        """TetrisEnv constructor. The seed determines the seeds of all games
+        played in the environment.
+        """
+        super(TetrisEnv, self).__init__()
+        if np is None:
+            raise RuntimeError('TetrisEnv requires NumPy')
+        self.seeds  = random.Random(seed)
+        self.engine = TetrisEngine(gridsize, 0)
+        self.frame  = 0
+
+
+    def reset(self, seed=None):
+        """Begins a new game and returns its first observation.
+        """
+        self.engine.reset(self.seeds.randrange(2**32) if seed is None else seed)
+        self.frame = 0
+        return self.observe()
+
+
+    def step(self, action):
+        """Performs an action and advances one frame. Returns the observation,
+        the reward, whether the game is over and a dict of extra information.
+        """
+        engine = self.engine
+        score = engine.score
+        engine.perform(action)
+
+        if self.frame >= tickframes[engine.ticklevel - 1]:
+            self.frame = 0
+            engine.tick()
+        self.frame += 1
+
+        info = {'lines': engine.lines, 'speedlevel': engine.speedlevel}
+        return self.observe(), engine.score - score, engine.lost, info
+
+
+    def observe(self):
+        """Returns the observation of the current state.
+        """
+        engine = self.engine
+        return {
+            'grid'    : np.array([row[1:-1] for row in engine.grid[1:-1]],
+                                 dtype=np.int8),
+            'piece'   : engine.piece,
+            'next'    : engine.nextpiece,
+            'position': (engine.row, engine.col, engine.angle)
+        }
+
+
+
+#______________________________________________________________________________
+
+class VectorTetrisEnv(object):
+    """Many TetrisEnv environments stepped together by a single call. The
+    state of all games is kept in NumPy arrays and every step is computed for
+    all of them at once, with no Python code running per environment.
+    Observations are dicts of arrays with one entry per environment, and
+    rewards and done flags are arrays too (as well as the ticked flags, telling
+    whether the timed update happened). These arrays are contiguous and reused
+    by the next step, so they must be copied to be kept. Environments whose
+    game is over are reset automatically, so the observation returned for them
+    is the first one of their next game.
+    """
+
+    nactions = nactions
+
+    def __init__(self, count, gridsize=(20, 10), seed=None):
+        """VectorTetrisEnv constructor. It allocates the state of count games.
+        """
+        super(VectorTetrisEnv, self).__init__()
+        if np is None:
+            raise RuntimeError('VectorTetrisEnv requires NumPy')
+        rows, cols = gridsize[0] + 2, gridsize[1] + 2
+        self.count      = count
+        self.gridsize   = rows, cols
+        self.random     = np.random.RandomState(seed)
+        self.spawncol   = (cols - 2) // 2 - 1
+        self.envs       = np.arange(count)
+        self.tickframes = np.array(tickframes, dtype=np.intp)
+
+        self.grid       = np.zeros((count, rows, cols), dtype=np.int8)
+        self.piece      = np.zeros(count, dtype=np.intp)
+        self.nextpiece  = np.zeros(count, dtype=np.intp)
+        self.angle      = np.zeros(count, dtype=np.intp)
+        self.row        = np.zeros(count, dtype=np.intp)
+        self.col        = np.zeros(count, dtype=np.intp)
+        self.frame      = np.zeros(count, dtype=np.intp)
+        self.score      = np.zeros(count, dtype=np.int64)
+        self.lines      = np.zeros(count, dtype=np.int64)
+        self.speedlevel = np.zeros(count, dtype=np.int64)
+        self.ticklevel  = np.zeros(count, dtype=np.intp)
+
+        self.obs = {
+            'grid'    : np.zeros((count, rows - 2, cols - 2), dtype=np.int8),
+            'piece'   : np.zeros(count, dtype=np.intp),
+            'next'    : np.zeros(count, dtype=np.intp),
+            'position': np.zeros((count, 3), dtype=np.intp)
+        }
+        self.rewards = np.zeros(count, dtype=np.int64)
+        self.dones   = np.zeros(count, dtype=bool)
+        self.ticked  = np.zeros(count, dtype=bool)
+
+
+    def reset(self):
+        """Begins new games in all environments and returns the observations.
+        """
+        self.reset_envs(self.envs)
+        self.dones[:] = False
+        return self.observe()
+
+
+    def reset_envs(self, envs):
+        """Begins new games in the environments of the given indices.
+        """
+        self.grid[envs] = 0
+        self.grid[envs, 0, :] = self.grid[envs, -1, :] = 8
+        self.grid[envs, :, 0] = self.grid[envs, :, -1] = 8
+        self.piece[envs]      = self.random.randint(1, 8, len(envs))
+        self.nextpiece[envs]  = self.random.randint(1, 8, len(envs))
+        self.angle[envs]      = 0
+        self.row[envs]        = 0
+        self.col[envs]        = self.spawncol
+        self.frame[envs]      = 0
+        self.score[envs]      = 0
+        self.lines[envs]      = 0
+        self.speedlevel[envs] = 1
+        self.ticklevel[envs]  = 2
+
+
+    def collides(self, angle, row, col):
+        """Tests, for every environment, whether its current tetrimino would
+        collide with any block of its grid at the given rotation and position.
+        Cells beyond the last row or column are clipped to the obstacle border
+        (they can only be reached when some other cell is already on it).
+        """
+        rows, cols = self.gridsize
+        cells = piecearray[self.piece, angle]
+        return self.grid[self.envs[:, None],
+                         np.minimum(row[:, None] + cells[:, :, 0], rows - 1),
+                         np.minimum(col[:, None] + cells[:, :, 1], cols - 1)
+                        ].any(axis=1)
+
+
+    def step(self, actions):
+        """Performs one action in each environment and advances one frame. See
+        TetrisEnv.step. Returns the observations, rewards and done flags.
+        """
+        actions = np.asarray(actions)
+        score = self.score.copy()
+
+        direction = (actions == RIGHT).astype(np.intp) - (actions == LEFT)
+        moved = (direction != 0) & \
+            ~self.collides(self.angle, self.row, self.col + direction)
+        self.col += direction * moved
+
+        angle = (self.angle + 1) % 4
+        rotated = (actions == ROTATE) & \
+            ~self.collides(angle, self.row, self.col)
+        self.angle[rotated] = angle[rotated]
+
+        fallen = (actions == QUICKFALL) & \
+            ~self.collides(self.angle, self.row + 1, self.col)
+        self.row += fallen
+
+        ticked = self.frame >= self.tickframes[self.ticklevel - 1]
+        self.frame += 1
+        self.frame[ticked] = 1
+        self.ticked[...] = ticked
+        fallen = ticked & ~self.collides(self.angle, self.row + 1, self.col)
+        self.row += fallen
+
+        self.dones[:] = False
+        locked = np.flatnonzero(ticked & ~fallen)
+        if len(locked):
+            self.lock(locked)
+
+        np.subtract(self.score, score, out=self.rewards)
+        finished = np.flatnonzero(self.dones)
+        if len(finished):
+            self.reset_envs(finished)
+        return self.observe(), self.rewards, self.dones
+
+
+    def lock(self, envs):
+        """Attaches the current tetriminos of the given environments to their
+        grids, clears completed rows, increases scores and speed levels, and
+        spawns the next tetriminos or flags the games as over.
+        """
+        cells = piecearray[self.piece[envs], self.angle[envs]]
+        self.grid[envs[:, None],
+                  self.row[envs, None] + cells[:, :, 0],
+                  self.col[envs, None] + cells[:, :, 1]] = \
+            self.piece[envs, None]
+
+        inner = self.grid[envs, 1:-1, 1:-1]
+        completed = (inner != 0).all(axis=2)
+        cleared = completed.sum(axis=1)
+        scoring = cleared > 0
+        if scoring.any():
+            self.clear_rows(envs[scoring], inner[scoring], completed[scoring],
+                            cleared[scoring])
+
+        # The game is lost if there is any block in the first visible row.
+        lost = self.grid[envs, 1, 1:-1].any(axis=1)
+        self.dones[envs[lost]] = True
+        envs = envs[~lost]
+        self.piece[envs]     = self.nextpiece[envs]
+        self.nextpiece[envs] = self.random.randint(1, 8, len(envs))
+        self.angle[envs]     = 0
+        self.row[envs]       = 0
+        self.col[envs]       = self.spawncol
+
+
+    def clear_rows(self, envs, inner, completed, cleared):
+        """Clears the completed rows of the given environments, given the inner
+        part of their grids (without the obstacle border), which rows were
+        completed and how many. It also increases scores, lines and speed
+        levels, just like TetrisScene.timedupdate.
+        """
+        # Score every run of consecutive completed rows, at its first row.
+        height = completed.shape[1]
+        padded = np.zeros((len(envs), height + 5), dtype=bool)
+        padded[:, 1:height+1] = completed
+        runs = np.zeros((len(envs), height), dtype=np.intp)
+        streak = completed.copy()
+        for k in range(4):
+            runs += streak
+            streak &= padded[:, k+2:height+k+2]
+        starts = completed & ~padded[:, :height]
+        bonus = np.array(rowbonus)[np.minimum(runs, 4)] * starts
+        self.score[envs] += bonus.sum(axis=1)
+
+        # Completed rows go to the top (keeping the order of the others) and
+        # are emptied.
+        order = np.argsort(~completed, axis=1, kind='stable')
+        inner = np.take_along_axis(inner, order[:, :, None], axis=1)
+        inner[np.arange(height) < cleared[:, None]] = 0
+        self.grid[envs, 1:-1, 1:-1] = inner
+
+        self.lines[envs] += cleared
+        levelup = envs[self.lines[envs] >= 12*self.speedlevel[envs] - 2]
+        self.speedlevel[levelup] += 1
+        self.ticklevel[levelup] = np.minimum(self.speedlevel[levelup],
+                                             len(speedintervals))
+
+
+    def observe(self):
+        """Fills the observation arrays with the current state and returns them.
+        """
+        obs = self.obs
+        obs['grid'][...] = self.grid[:, 1:-1, 1:-1]
+        obs['piece'][...] = self.piece
+        obs['next'][...] = self.nextpiece
+        obs['position'][:, 0] = self.row
+        obs['position'][:, 1] = self.col
+        obs['position'][:, 2] = self.angle
+        return obs
@@ -0,0 +1,249 @@
+# -*- coding: utf-8
+
+from __future__ import print_function
+from multiprocessing.pool import ThreadPool
+import pygame
+from tetris import Tetrimino, colormap
+from tetrisenv import TetrisEngine
+from autoplayer import AutoPlayer
+
+
+#______________________________________________________________________________
+
+def snapshot(scene):
+    """Returns a snapshot of the grid of a TetrisScene (a copy of it, with the
+    obstacle border) with the current tetrimino drawn in, which can be
+    rendered while the gameplay goes on.
+    """
+    grid = [row[:] for row in scene.grid]
+    t = scene.currtetri
+    if t:
+        for i, j in t.cells[t.angle // 90]:
+            grid[t.row + i][t.col + j] = t.id
+    return grid
+
+
+
+def engine_snapshot(engine):
+    """Returns a snapshot of the grid of a tetrisenv.TetrisEngine, like
+    snapshot.
+    """
+    grid = [row[:] for row in engine.grid]
+    for i, j in Tetrimino.cellmap[engine.piece][engine.angle]:
+        grid[engine.row + i][engine.col + j] = engine.piece
+    return grid
+
+
+
+#______________________________________________________________________________
+
+class ThumbnailRenderer(object):
+    """Renders snapshots of many Tetris grids as thumbnails, off-screen, on a
+    pool of threads (pygame releases the GIL while filling surfaces), right
+    into a composite surface of all of them, which is then drawn with a single
+    blit per frame. Every thumbnail is a subsurface of its own area of the
+    composite, so threads never draw on the same pixels. The composite is
+    double buffered: a batch is rendered into the back one while the front
+    one is shown, and they are swapped when the batch is finished.
+    """
+
+    def __init__(self, count, gridsize=(20, 10), size=(40, 80), columns=8,
+                 margin=4, threads=4):
+        """ThumbnailRenderer constructor. It allocates the composite surfaces
+        of count thumbnails of the given size (for grids of gridsize, without
+        the border), laid out in the given number of columns with a margin
+        between them, and starts the thread pool.
+        """
+        super(ThumbnailRenderer, self).__init__()
+        rows = (count + columns - 1) // columns
+        self.count      = count
+        self.gridsize   = gridsize
+        self.size       = size
+        self.blocksize  = (max(size[0] // gridsize[1], 1),
+                           max(size[1] // gridsize[0], 1))
+        self.positions  = [((k % columns) * (size[0] + margin),
+                            (k // columns) * (size[1] + margin))
+                           for k in range(count)]
+        self.composites = [pygame.Surface(
+                               (columns * (size[0] + margin) - margin,
+                                rows * (size[1] + margin) - margin))
+                           for _ in range(2)]
+        self.thumbnails = [[composite.subsurface(pygame.Rect(position, size))
+                            for position in self.positions]
+                           for composite in self.composites]
+        self.front      = 0
+        self.surface    = self.composites[self.front]
+        self.pending    = None
+        self.pool       = ThreadPool(threads)
+
+
+    def render(self, task):
+        """Renders a grid snapshot on its thumbnail of the back composite. It
+        runs on the pool threads.
+        """
+        k, grid = task
+        surface = self.thumbnails[1 - self.front][k]
+        width, height = self.blocksize
+        rect = pygame.Rect(0, 0, width - (width > 2), height - (height > 2))
+        surface.fill((0, 0, 0))
+        for i in range(1, len(grid) - 1):
+            row = grid[i]
+            for j in range(1, len(row) - 1):
+                if row[j]:
+                    rect.x = (j - 1) * width
+                    rect.y = (i - 1) * height
+                    surface.fill(colormap[row[j]], rect)
+        return k
+
+
+    def ready(self):
+        """Tests whether a new batch can be submitted (the previous one was
+        finished and shown).
+        """
+        return self.pending is None
+
+
+    def submit(self, grids):
+        """Starts rendering a batch of grid snapshots (see snapshot), one per
+        thumbnail. Returns False, doing nothing, if the previous batch is not
+        finished yet.
+        """
+        if self.pending is not None:
+            return False
+        self.pending = self.pool.map_async(self.render, list(enumerate(grids)))
+        return True
+
+
+    def update(self):
+        """Swaps the composites if the last batch is finished, so that it is
+        shown. Returns True if the shown composite changed.
+        """
+        if self.pending is None or not self.pending.ready():
+            return False
+        self.pending.get() # Raises the exceptions of the threads, if any.
+        self.pending = None
+        self.front = 1 - self.front
+        self.surface = self.composites[self.front]
+        return True
+
+
+    def draw(self, target, position):
+        """Draws the front composite of all thumbnails on a target surface.
+        """
+        target.blit(self.surface, position)
+
+
+    def close(self):
+        """Waits for the last batch and stops the thread pool.
+        """
+        self.pool.close()
+        self.pool.join()
+
+
+
+#______________________________________________________________________________
+
+class RivalBoards(object):
+    """Boards autoplayed beside a gameplay (tetrisenv.TetrisEngine games,
+    restarted when lost), shown as thumbnails rendered by a ThumbnailRenderer.
+    Every board places a tetrimino every interval frames, at staggered frames,
+    and the thumbnails are rendered again whenever a board changed.
+    """
+
+    def __init__(self, count, gridsize=(20, 10), columns=8, interval=15,
+                 threads=4):
+        """RivalBoards constructor. See ThumbnailRenderer.__init__ for the
+        layout of the count thumbnails.
+        """
+        super(RivalBoards, self).__init__()
+        self.boards   = [TetrisEngine(gridsize) for _ in range(count)]
+        self.player   = AutoPlayer()
+        self.renderer = ThumbnailRenderer(count, gridsize, columns=columns,
+                                          threads=threads)
+        self.interval = interval
+        self.frame    = 0
+        self.changed  = True
+
+
+    def update(self):
+        """Plays one frame of the boards, and submits their snapshots to the
+        renderer if any of them changed (once it is ready for a new batch).
+        """
+        self.frame += 1
+        for k, board in enumerate(self.boards):
+            if (self.frame + k) % self.interval == 0:
+                if not self.player.place(board) or board.lost:
+                    board.reset()
+                self.changed = True
+        if self.changed and self.renderer.ready():
+            self.renderer.submit([engine_snapshot(board)
+                                  for board in self.boards])
+            self.changed = False
+
+
+    def draw(self, target, position):
+        """Draws the thumbnails of the last rendered batch on a target surface
+        (see ThumbnailRenderer.update and draw).
+        """
+        self.renderer.update()
+        self.renderer.draw(target, position)
+
+
+    def close(self):
+        """Stops the renderer.
+        """
+        self.renderer.close()
+
+
+
+#______________________________________________________________________________
+
+
+if __name__ == '__main__':
+    import argparse, random, time
+    from tetris import NOOP, LEFT, RIGHT, ROTATE, QUICKFALL
+    from tetrisenv import tickframes
+
+    parser = argparse.ArgumentParser(
+        description='Monitor many randomly played boards as thumbnails')
+    parser.add_argument('--boards', type=int, default=64)
+    parser.add_argument('--columns', type=int, default=16)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--frames', type=int, default=0,
+                        help='quit after FRAMES frames (0 runs until closed)')
+    args = parser.parse_args()
+
+    renderer = ThumbnailRenderer(args.boards, columns=args.columns,
+                                 threads=args.threads)
+    pygame.display.init()
+    screen = pygame.display.set_mode(renderer.surface.get_size())
+    pygame.display.set_caption('Just Another Tetris Clone - Overview')
+
+    rng = random.Random(0)
+    engines = [TetrisEngine(seed=seed) for seed in range(args.boards)]
+    clock = pygame.time.Clock()
+    frame = 0
+    mainthread = 0.0
+    running = True
+    while running and frame != args.frames:
+        for event in pygame.event.get():
+            running = running and event.type != pygame.QUIT
+        for engine in engines:
+            engine.perform(rng.choice((NOOP, LEFT, RIGHT, ROTATE, QUICKFALL)))
+            if frame % tickframes[engine.ticklevel - 1] == 0:
+                engine.tick()
+            if engine.lost:
+                engine.reset()
+
+        begin = time.time()
+        renderer.update()
+        renderer.submit([engine_snapshot(engine) for engine in engines])
+        renderer.draw(screen, (0, 0))
+        mainthread += time.time() - begin
+        pygame.display.update()
+        clock.tick(30)
+        frame += 1
+
+    renderer.close()
+    print('Main thread time per frame: {:.2f} ms'.format(
+        1000 * mainthread / max(frame, 1)))
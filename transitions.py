@@ -0,0 +1,203 @@
+# -*- coding: utf-8
+
+from __future__ import print_function
+import json, os
+import numpy as np
+
+
+#______________________________________________________________________________
+
+def transition_dtype(gridsize):
+    """Returns the NumPy record type of a transition in a grid of the given
+    size (without the obstacle border): the board of settled blocks, the ids of
+    the current and next tetriminos, the current tetrimino's position (row,
+    column and rotation index), the action, the reward and the done flag.
+    """
+    return np.dtype([
+        ('board',    np.int8, tuple(gridsize)),
+        ('piece',    np.uint8),
+        ('next',     np.uint8),
+        ('position', np.int16, (3,)),
+        ('action',   np.uint8),
+        ('reward',   np.int32),
+        ('done',     np.bool_)
+    ])
+
+
+
+#______________________________________________________________________________
+
+class TransitionRecorder(object):
+    """Streams transitions into a dataset directory of memory-mapped NumPy
+    (.npy) chunk files. Each chunk is preallocated with room for chunksize
+    transitions and filled in place; a new chunk is started when it is full.
+    Chunks are never rewritten once closed, and recording to an existing
+    dataset just appends new chunks. The dataset index (index.json) lists the
+    chunks and how many transitions each one holds.
+    The board, piece ids and position of a transition are the state reached
+    after performing its action, like the observations of tetrisenv.TetrisEnv.
+    """
+
+    def __init__(self, directory, gridsize=(20, 10), chunksize=2**16):
+        """TransitionRecorder constructor. It opens (or creates) the dataset
+        directory and its index.
+        """
+        super(TransitionRecorder, self).__init__()
+        self.directory = directory
+        self.chunksize = chunksize
+        self.dtype     = transition_dtype(gridsize)
+        self.chunk     = None
+        self.count     = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        indexname = os.path.join(directory, 'index.json')
+        if os.path.exists(indexname):
+            with open(indexname) as indexfile:
+                self.index = json.load(indexfile)
+            if self.index['gridsize'] != list(gridsize):
+                raise ValueError('Transitions of another grid size in ' +
+                                 directory)
+        else:
+            self.index = {'gridsize': list(gridsize), 'chunks': []}
+
+
+    def new_chunk(self):
+        """Closes the current chunk (if any) and preallocates a new one.
+        """
+        self.close_chunk()
+        filename = 'chunk-{:06d}.npy'.format(len(self.index['chunks']))
+        self.chunk = np.lib.format.open_memmap(
+            os.path.join(self.directory, filename), mode='w+',
+            dtype=self.dtype, shape=(self.chunksize,))
+        self.count = 0
+        self.index['chunks'].append([filename, 0])
+
+
+    def close_chunk(self):
+        """Flushes the current chunk to disk and stops writing to it.
+        """
+        if self.chunk is not None:
+            self.flush()
+            self.chunk = None
+
+
+    def record(self, grid, piece, nextpiece, position, action, reward, done):
+        """Records a transition. The grid may be a TetrisScene grid (a list of
+        lists, with the obstacle border) or an array without the border.
+        """
+        if self.chunk is None or self.count == self.chunksize:
+            self.new_chunk()
+        transition = self.chunk[self.count]
+        if isinstance(grid, np.ndarray):
+            transition['board'] = grid
+        else:
+            transition['board'] = [row[1:-1] for row in grid[1:-1]]
+        transition['piece']    = piece
+        transition['next']     = nextpiece
+        transition['position'] = position
+        transition['action']   = action
+        transition['reward']   = reward
+        transition['done']     = done
+        self.count += 1
+
+
+    def record_many(self, obs, actions, rewards, dones):
+        """Records one transition per environment of a step of a
+        tetrisenv.VectorTetrisEnv, given its observations, the actions and the
+        rewards and done flags it returned.
+        """
+        start = 0
+        total = len(actions)
+        while start < total:
+            if self.chunk is None or self.count == self.chunksize:
+                self.new_chunk()
+            size = min(total - start, self.chunksize - self.count)
+            block = self.chunk[self.count:self.count + size]
+            block['board']    = obs['grid'][start:start + size]
+            block['piece']    = obs['piece'][start:start + size]
+            block['next']     = obs['next'][start:start + size]
+            block['position'] = obs['position'][start:start + size]
+            block['action']   = actions[start:start + size]
+            block['reward']   = rewards[start:start + size]
+            block['done']     = dones[start:start + size]
+            self.count += size
+            start += size
+
+
+    def flush(self):
+        """Writes the recorded transitions and the updated index to disk.
+        """
+        if self.chunk is None:
+            return
+        self.chunk.flush()
+        self.index['chunks'][-1][1] = self.count
+        indexname = os.path.join(self.directory, 'index.json')
+        with open(indexname + '.tmp', 'w') as indexfile:
+            json.dump(self.index, indexfile)
+        os.rename(indexname + '.tmp', indexname)
+
+
+    def close(self):
+        """Flushes and closes the recorder.
+        """
+        self.close_chunk()
+
+
+
+#______________________________________________________________________________
+
+class TransitionDataset(object):
+    """Read-only view of a dataset written by TransitionRecorder. Chunks are
+    memory-mapped, so indexing or slicing only reads the transitions asked for
+    from disk, whatever the size of the dataset.
+    """
+
+    def __init__(self, directory):
+        """TransitionDataset constructor. It reads the index and maps the
+        chunks into memory.
+        """
+        super(TransitionDataset, self).__init__()
+        with open(os.path.join(directory, 'index.json')) as indexfile:
+            index = json.load(indexfile)
+        self.dtype  = transition_dtype(index['gridsize'])
+        self.chunks = [np.load(os.path.join(directory, filename),
+                               mmap_mode='r')[:count]
+                       for filename, count in index['chunks'] if count]
+        self.offsets = np.cumsum([0] + [len(chunk) for chunk in self.chunks])
+
+
+    def __len__(self):
+        """Returns the number of transitions in the dataset.
+        """
+        return int(self.offsets[-1])
+
+
+    def __getitem__(self, key):
+        """Returns a transition (given its index) or an array of transitions
+        (given a slice with no step). Slices within a single chunk are views
+        of the memory-mapped file; slices across chunks are copied.
+        """
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('Slices of transitions cannot have steps')
+            first = np.searchsorted(self.offsets, start, side='right') - 1
+            parts = []
+            while start < stop:
+                chunk = self.chunks[first]
+                begin = start - self.offsets[first]
+                end = min(stop - self.offsets[first], len(chunk))
+                parts.append(chunk[begin:end])
+                start += end - begin
+                first += 1
+            if not parts:
+                return np.zeros(0, self.dtype)
+            return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('Transition index out of range')
+        chunkindex = np.searchsorted(self.offsets, key, side='right') - 1
+        return self.chunks[chunkindex][key - self.offsets[chunkindex]]
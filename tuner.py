@@ -0,0 +1,190 @@
+# -*- coding: utf-8
+
+from __future__ import print_function
+import json, multiprocessing, os, random
+from autoplayer import AutoPlayer, defaultweights
+from tetrisenv import TetrisEngine
+
+
+#______________________________________________________________________________
+
+# Per-process state of the pool workers: the engine (and grid size) reused by
+# all the games a worker plays.
+workerengine = None
+
+
+def play_game(task):
+    """Plays a whole game with the autoplayer (placing each tetrimino straight
+    away) and returns the candidate index with the number of lines cleared.
+    It runs on the pool workers, which keep their engine between tasks.
+    """
+    global workerengine
+    candidate, weights, seed, gridsize, maxpieces = task
+    if workerengine is None or workerengine.gridsize[0] != gridsize[0] + 2 \
+                            or workerengine.gridsize[1] != gridsize[1] + 2:
+        workerengine = TetrisEngine(gridsize, seed)
+    else:
+        workerengine.reset(seed)
+
+    player = AutoPlayer(weights)
+    pieces = 0
+    while not workerengine.lost and pieces < maxpieces:
+        if not player.place(workerengine):
+            break
+        pieces += 1
+    return candidate, workerengine.lines
+
+
+
+#______________________________________________________________________________
+
+class Tuner(object):
+    """Tunes the autoplayer's board evaluation weights with an evolution
+    strategy. Every generation, a population of candidate weights is sampled
+    around the current mean and each candidate plays the same seeded games on
+    a pool of worker processes (created once and kept warm for all the
+    generations). Games are played in rounds, and after each round the
+    candidates far behind the best ones are dropped. The mean then moves to the
+    average of the best candidates (the elite) and the step size shrinks.
+    The state is saved to a checkpoint file after every generation, and tuning
+    resumes from it if it already exists.
+    """
+
+    def __init__(self, checkpoint='tuner.json', population=32, elite=8,
+                 games=64, rounds=4, cutoff=0.5, sigma=0.3, gridsize=(20, 10),
+                 maxpieces=1000, processes=None, seed=0):
+        """Tuner constructor. Each candidate plays up to games games, in the
+        given number of rounds, and is dropped after a round if its average
+        lines are below cutoff times the elite's worst average.
+        """
+        super(Tuner, self).__init__()
+        self.checkpoint = checkpoint
+        self.population = population
+        self.elite      = elite
+        self.games      = games
+        self.rounds     = rounds
+        self.cutoff     = cutoff
+        self.gridsize   = tuple(gridsize)
+        self.maxpieces  = maxpieces
+        self.processes  = processes or multiprocessing.cpu_count()
+        self.seed       = seed
+        self.state      = {
+            'generation': 0,
+            'mean'      : list(defaultweights),
+            'sigma'     : sigma,
+            'best'      : {'weights': list(defaultweights), 'fitness': None},
+            'history'   : []
+        }
+        if os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as checkpointfile:
+                self.state = json.load(checkpointfile)
+
+
+    def save(self):
+        """Saves the tuner state to the checkpoint file.
+        """
+        with open(self.checkpoint + '.tmp', 'w') as checkpointfile:
+            json.dump(self.state, checkpointfile, indent=2)
+        os.rename(self.checkpoint + '.tmp', self.checkpoint)
+
+
+    def evaluate(self, pool, candidates, seeds):
+        """Returns the average lines cleared by each candidate in the seeded
+        games (or in the rounds of games it played before being dropped).
+        """
+        totals  = [0] * len(candidates)
+        played  = [0] * len(candidates)
+        alive   = list(range(len(candidates)))
+        perround = max(len(seeds) // self.rounds, 1)
+        for start in range(0, len(seeds), perround):
+            tasks = [(c, candidates[c], seed, self.gridsize, self.maxpieces)
+                     for c in alive for seed in seeds[start:start + perround]]
+            chunksize = max(len(tasks) // (4 * self.processes), 1)
+            for c, lines in pool.imap_unordered(play_game, tasks, chunksize):
+                totals[c] += lines
+                played[c] += 1
+
+            means = sorted((totals[c] / float(played[c]) for c in alive),
+                           reverse=True)
+            threshold = self.cutoff * means[min(self.elite, len(means)) - 1]
+            alive = [c for c in alive
+                     if totals[c] / float(played[c]) >= threshold]
+        return [totals[c] / float(played[c]) for c in range(len(candidates))]
+
+
+    def run(self, generations):
+        """Runs the given number of generations (counting the ones already in
+        the checkpoint) and returns the best weights found.
+        """
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            while self.state['generation'] < generations:
+                self.step(pool)
+                self.save()
+        finally:
+            pool.close()
+            pool.join()
+        return self.state['best']['weights']
+
+
+    def step(self, pool):
+        """Runs one generation.
+        """
+        state = self.state
+        rng = random.Random(self.seed * 1000003 + state['generation'])
+        mean, sigma = state['mean'], state['sigma']
+
+        # The mean itself is a candidate too, so it is always re-evaluated.
+        candidates = [mean] + [[w + rng.gauss(0, sigma) for w in mean]
+                               for _ in range(self.population - 1)]
+        seeds = [rng.randrange(2**32) for _ in range(self.games)]
+        fitness = self.evaluate(pool, candidates, seeds)
+
+        ranking = sorted(range(len(candidates)), key=lambda c: -fitness[c])
+        elite = [candidates[c] for c in ranking[:self.elite]]
+        state['mean'] = [sum(ws) / len(elite) for ws in zip(*elite)]
+        state['sigma'] = sigma * 0.95
+
+        best = ranking[0]
+        if state['best']['fitness'] is None or \
+           fitness[best] > state['best']['fitness']:
+            state['best'] = {'weights': candidates[best],
+                             'fitness': fitness[best]}
+        state['history'].append({'generation': state['generation'],
+                                 'best': fitness[best],
+                                 'mean': sum(fitness) / len(fitness)})
+        state['generation'] += 1
+        print('Generation {}: best {:.1f} lines, weights {}'.format(
+            state['generation'], fitness[best],
+            ', '.join('{:.3f}'.format(w) for w in candidates[best])))
+
+
+
+#______________________________________________________________________________
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Tune the autoplayer weights with an evolution strategy')
+    parser.add_argument('--generations', type=int, default=50)
+    parser.add_argument('--population', type=int, default=32)
+    parser.add_argument('--elite', type=int, default=8)
+    parser.add_argument('--games', type=int, default=64,
+                        help='games per candidate and generation')
+    parser.add_argument('--rounds', type=int, default=4,
+                        help='rounds of games after which weak candidates '
+                             'are dropped')
+    parser.add_argument('--maxpieces', type=int, default=1000,
+                        help='maximum tetriminos per game')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--checkpoint', default='tuner.json')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    tuner = Tuner(checkpoint=args.checkpoint, population=args.population,
+                  elite=args.elite, games=args.games, rounds=args.rounds,
+                  maxpieces=args.maxpieces, processes=args.processes,
+                  seed=args.seed)
+    print('Best weights:', tuner.run(args.generations))